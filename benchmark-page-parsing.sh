@@ -0,0 +1,3 @@
+#!/bin/bash
+set -e
+venv/bin/python -m spectrum.page_parsing $*
@@ -3,8 +3,11 @@ import os
 import sys
 
 import pytest
+from spectrum import checks
 from spectrum import generator
 from spectrum import logger
+from spectrum import sessions
+from spectrum import synthesizer
 # so that other processes run by xdist can still print
 # http://stackoverflow.com/questions/27006884/pytest-xdist-without-capturing-output
 # https://github.com/pytest-dev/pytest/issues/680
@@ -16,6 +19,11 @@ def pytest_addoption(parser):
                      default=None,
                      help="pass an article id to filter only tests related to it")
 
+def pytest_unconfigure():
+    checks.LATENCY_HINTS.save()
+    sessions.log_statistics()
+    checks.RESOURCE_CACHE.log_statistics()
+
 @pytest.fixture
 def article_id_filter(request):
     return request.config.getoption('--article-id')
@@ -31,6 +39,30 @@ def generate_article():
     yield from_template_id
     _clean_all(created_articles)
 
+@pytest.yield_fixture
+def generate_articles():
+    "For load tests: many unique articles, generated in parallel"
+    created_articles = []
+    def from_template_ids(template_ids, count, **template_variables):
+        articles = []
+        for article in generator.article_zips([str(template_id) for template_id in template_ids], count, template_variables=template_variables):
+            created_articles.append(article)
+            articles.append(article)
+        return articles
+    yield from_template_ids
+    _clean_all(created_articles)
+
+@pytest.yield_fixture
+def generate_synthetic_article():
+    "For benchmarks: an article of the requested size, see synthesizer.article_zip"
+    created_articles = []
+    def from_sizes(**sizes):
+        article = synthesizer.article_zip(**sizes)
+        created_articles.append(article)
+        return article
+    yield from_sizes
+    _clean_all(created_articles)
+
 @pytest.yield_fixture
 def version_article():
     created_articles = []
@@ -11,6 +11,9 @@ SPECTRUM_PROCESSES=${SPECTRUM_PROCESSES:-4}
 # clean up possible previous builds
 rm -f build/junit.xml
 rm -f build/test.log
+rm -f build/resources.sqlite*
+rm -f build/article-id-blocks*
+rm -f build/journal-cms-*.cookies*
 rm -rf /tmp/elife-*
 
 # sanity check
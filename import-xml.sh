@@ -9,5 +9,4 @@ fi
 
 id="$1"
 source_filename="$2"
-xmllint -format "$source_filename" | sed -e "s/$id/{{ article['id'] }}/g" > "spectrum/templates/elife-$id-vor-r1/elife-$id.xml.jinja"
-
+venv/bin/python spectrum/import.py --xml "$id" "$source_filename"
@@ -1,4 +1,5 @@
 #!/bin/bash
 set -e
+venv/bin/python -c "import lxml" || (echo "lxml not found in venv. Try running ./install.sh"; exit 1)
 venv/bin/python spectrum/import.py $*
 
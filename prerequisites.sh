@@ -1,3 +1,4 @@
 #!/bin/bash
 set -e
-which xmllint || (echo "xmllint not found. Try installing the libxml2-utils package"; exit 1)
+# lxml pretty prints the imported XML, and is built from source by pip
+which xslt-config || (echo "xslt-config not found. Try installing the libxml2-dev and libxslt1-dev packages"; exit 1)
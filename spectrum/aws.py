@@ -1,68 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import re
+import threading
+import time
 
-import boto3
 from spectrum.config import SETTINGS
-from spectrum import logger
+from spectrum import lazy, logger
 
 LOGGER = logger.logger(__name__)
-S3 = boto3.resource(
-    's3',
-    aws_access_key_id=SETTINGS['aws_access_key_id'],
-    aws_secret_access_key=SETTINGS['aws_secret_access_key'],
-    region_name=SETTINGS['region_name']
-)
-SWF = boto3.client(
-    'swf',
-    aws_access_key_id=SETTINGS['aws_access_key_id'],
-    aws_secret_access_key=SETTINGS['aws_secret_access_key'],
-    region_name=SETTINGS['region_name']
-)
-SQS = boto3.client(
-    'sqs',
-    aws_access_key_id=SETTINGS['aws_access_key_id'],
-    aws_secret_access_key=SETTINGS['aws_secret_access_key'],
-    region_name=SETTINGS['region_name']
-)
+# the default boto3 session is not safe to build clients from in parallel
+_BOTO3_LOCK = threading.Lock()
+
+def _resource(service_name):
+    # importing boto3 takes a significant part of the startup of a process that may never use it
+    import boto3
+    with _BOTO3_LOCK:
+        return boto3.resource(
+            service_name,
+            aws_access_key_id=SETTINGS['aws_access_key_id'],
+            aws_secret_access_key=SETTINGS['aws_secret_access_key'],
+            region_name=SETTINGS['region_name']
+        )
+
+def _client(service_name):
+    import boto3
+    with _BOTO3_LOCK:
+        return boto3.client(
+            service_name,
+            aws_access_key_id=SETTINGS['aws_access_key_id'],
+            aws_secret_access_key=SETTINGS['aws_secret_access_key'],
+            region_name=SETTINGS['region_name']
+        )
+
+# built at their first use
+S3 = lazy.Lazy(lambda: _resource('s3'))
+SWF = lazy.Lazy(lambda: _client('swf'))
+SQS = lazy.Lazy(lambda: _client('sqs'))
+
+# how many buckets and workflow executions are cleaned at the same time
+CLEAN_CONCURRENCY = 10
+# maximum allowed by delete_objects
+DELETE_BATCH_SIZE = 1000
+
+# how old a bucket listing can be before it is refreshed,
+# aligned with the maximum delay between polls of checks
+LISTING_INTERVAL = 5
+# listings nobody asked for during this long are dropped, as their checks have finished
+LISTING_RETENTION = 60
+
+class BucketListing:
+    """Snapshot of the objects under a prefix of a bucket.
+
+    Every check waiting on the same bucket and prefix reads from the same snapshot,
+    which is refreshed at most once per interval"""
+    def __init__(self, s3, bucket_name, prefix, interval):
+        self._s3 = s3
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._objects = []
+        self._listed_at = None
+        self._used_at = time.time()
+
+    def idle(self):
+        "Seconds since the last call to objects()"
+        return time.time() - self._used_at
+
+    def objects(self):
+        "Returns a list of {'Key': ..., 'LastModified': ...} dictionaries"
+        with self._lock:
+            self._used_at = time.time()
+            if self._listed_at is None or time.time() - self._listed_at >= self._interval:
+                self._objects = self._list()
+                self._listed_at = time.time()
+            return self._objects
+
+    def _list(self):
+        paginator = self._s3.meta.client.get_paginator('list_objects_v2')
+        objects = []
+        for page in paginator.paginate(Bucket=self._bucket_name, Prefix=self._prefix):
+            objects.extend(page.get('Contents', []))
+        LOGGER.debug(
+            "Listed %d objects in bucket %s with prefix %s",
+            len(objects),
+            self._bucket_name,
+            self._prefix
+        )
+        return objects
+
+_BUCKET_LISTINGS = {}
+_BUCKET_LISTINGS_LOCK = threading.Lock()
+
+def bucket_listing(s3, bucket_name, prefix=''):
+    """Returns the BucketListing shared by all callers interested in this bucket and prefix.
+
+    Listings that have not been used for LISTING_RETENTION seconds are forgotten"""
+    key = (bucket_name, prefix)
+    with _BUCKET_LISTINGS_LOCK:
+        for idle_key in [k for (k, listing) in _BUCKET_LISTINGS.items() if listing.idle() > LISTING_RETENTION]:
+            del _BUCKET_LISTINGS[idle_key]
+        if key not in _BUCKET_LISTINGS:
+            _BUCKET_LISTINGS[key] = BucketListing(s3, bucket_name, prefix, LISTING_INTERVAL)
+        return _BUCKET_LISTINGS[key]
 
 def clean():
-    open_workflow_executions = SWF.list_open_workflow_executions(
+    """Terminates the open workflows in parallel, then empties the end2end buckets in parallel.
+
+    Workflows are all terminated first so that none of them writes into a bucket that is being emptied.
+    Executions and keys are processed a page at a time, so memory use does not depend on how many there are"""
+    with ThreadPoolExecutor(max_workers=CLEAN_CONCURRENCY) as executor:
+        futures = [executor.submit(_terminate_workflow_execution, execution) for execution in _open_workflow_executions()]
+        for future in futures:
+            future.result()
+    all_buckets = S3.meta.client.list_buckets()['Buckets']
+    buckets_to_clean = [b['Name'] for b in all_buckets if re.match(r".*end2end.*", b['Name'])]
+    LOGGER.info("Cleaning up %d buckets: %s", len(buckets_to_clean), buckets_to_clean)
+    with ThreadPoolExecutor(max_workers=CLEAN_CONCURRENCY) as executor:
+        futures = [executor.submit(_clean_bucket, bucket_name) for bucket_name in buckets_to_clean]
+        for future in futures:
+            future.result()
+
+def _open_workflow_executions():
+    paginator = SWF.get_paginator('list_open_workflow_executions')
+    pages = paginator.paginate(
         domain='Publish.end2end',
         startTimeFilter={
             'oldestDate': datetime.datetime.now() - datetime.timedelta(days=1),
             'latestDate': datetime.datetime.now()
         }
     )
-    assert 'executionInfos' in open_workflow_executions
-    for workflow in open_workflow_executions['executionInfos']:
-        SWF.terminate_workflow_execution(
-            domain='Publish.end2end',
-            workflowId=workflow['execution']['workflowId'],
-            runId=workflow['execution']['runId'],
-            reason='end2end testing environment cleanup'
-        )
-        LOGGER.info(
-            "Terminated workflow: workflowId=%s runId=%s",
-            workflow['execution']['workflowId'],
-            workflow['execution']['runId']
-        )
+    for page in pages:
+        assert 'executionInfos' in page
+        for workflow in page['executionInfos']:
+            yield workflow['execution']
 
-    all_buckets = S3.meta.client.list_buckets()['Buckets']
-    buckets_to_clean = [b['Name'] for b in all_buckets if re.match(r".*end2end.*", b['Name'])]
-    LOGGER.info("Cleaning up %d buckets: %s", len(buckets_to_clean), buckets_to_clean)
-    for bucket_name in buckets_to_clean:
-        bucket = S3.Bucket(bucket_name)
-        bucket.load()
-        keys = [file.key for file in bucket.objects.all()]
-        batch_size = 100
-        batches = [keys[lower:lower+batch_size] for lower in range(0, len(keys), batch_size)]
-        for batch in batches:
-            bucket.delete_objects(Delete={
-                'Objects': [{'Key': key} for key in batch]
-            })
-            LOGGER.info(
-                "Deleted from bucket %s the keys %s",
-                bucket_name,
-                batch
-            )
+def _terminate_workflow_execution(execution):
+    SWF.terminate_workflow_execution(
+        domain='Publish.end2end',
+        workflowId=execution['workflowId'],
+        runId=execution['runId'],
+        reason='end2end testing environment cleanup'
+    )
+    LOGGER.info(
+        "Terminated workflow: workflowId=%s runId=%s",
+        execution['workflowId'],
+        execution['runId']
+    )
 
+def _clean_bucket(bucket_name):
+    "Each page of the listing is deleted with a single request, before the next one is read"
+    paginator = S3.meta.client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket_name, PaginationConfig={'PageSize': DELETE_BATCH_SIZE})
+    deleted = 0
+    for page in pages:
+        keys = [s3_object['Key'] for s3_object in page.get('Contents', [])]
+        if not keys:
+            continue
+        response = S3.meta.client.delete_objects(Bucket=bucket_name, Delete={
+            'Objects': [{'Key': key} for key in keys],
+            'Quiet': True
+        })
+        errors = response.get('Errors', [])
+        assert not errors, ("Could not delete from bucket %s: %s" % (bucket_name, errors))
+        deleted = deleted + len(keys)
+        LOGGER.info("Deleted from bucket %s %d keys, from %s to %s", bucket_name, len(keys), keys[0], keys[-1])
+    LOGGER.info("Deleted from bucket %s %d keys in total", bucket_name, deleted)
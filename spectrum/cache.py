@@ -0,0 +1,78 @@
+"Remembers which resources have already been verified, across all the processes of a run"
+import sqlite3
+import threading
+import time
+
+from spectrum import logger
+
+LOGGER = logger.logger(__name__)
+
+class ResourceCache:
+    """Status codes of urls, stored in a sqlite file that parallel processes can share.
+
+    Entries expire after their ttl; when there are more than max_entries, the oldest ones are evicted"""
+    def __init__(self, filename, ttl, max_entries):
+        self._filename = filename
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, url):
+        "Returns the cached status code, or None"
+        with self._lock:
+            row = self._db().execute(
+                "SELECT status FROM resources WHERE url = ? AND expires_at > ?",
+                (url, time.time())
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return row[0]
+
+    def put(self, url, status, ttl=None):
+        ttl = ttl if ttl is not None else self._ttl
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO resources (url, status, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (url, status, now, now + ttl)
+            )
+            db.execute("DELETE FROM resources WHERE expires_at <= ?", (now,))
+            db.execute(
+                "DELETE FROM resources WHERE url IN (SELECT url FROM resources ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,)
+            )
+
+    def statistics(self):
+        with self._lock:
+            (entries, ) = self._db().execute("SELECT COUNT(*) FROM resources").fetchone()
+            return {'hits': self._hits, 'misses': self._misses, 'entries': entries}
+
+    def log_statistics(self):
+        "Only if this process used the cache, so that the file is not created just to report on it"
+        if self._connection is None:
+            return
+        statistics = self.statistics()
+        LOGGER.info(
+            "Resource cache %s: %d hits, %d misses, %d entries",
+            self._filename,
+            statistics['hits'],
+            statistics['misses'],
+            statistics['entries']
+        )
+
+    def _db(self):
+        if self._connection is None:
+            # autocommit, other processes wait for locks up to the timeout
+            self._connection = sqlite3.connect(self._filename, timeout=30, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS resources (url TEXT PRIMARY KEY, status INTEGER, stored_at REAL, expires_at REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS resources_stored_at ON resources (stored_at)")
+        return self._connection
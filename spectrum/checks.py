@@ -1,14 +1,16 @@
+from contextlib import contextmanager
 from datetime import datetime
 from pprint import pformat
 import os
 import re
 from ssl import SSLError
+import threading
+import time
 
-from bs4 import BeautifulSoup
-import polling
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from requests.exceptions import ConnectionError
-from spectrum import aws, logger
+from spectrum import aws, cache, lazy, logger, pages, scheduling, sessions
 from spectrum.config import SETTINGS
 
 
@@ -17,15 +19,21 @@ requests.packages.urllib3.disable_warnings()
 
 
 GLOBAL_TIMEOUT = int(os.environ['SPECTRUM_TIMEOUT']) if 'SPECTRUM_TIMEOUT' in os.environ else 600
+PIPELINE_TIMEOUT = int(os.environ['SPECTRUM_PIPELINE_TIMEOUT']) if 'SPECTRUM_PIPELINE_TIMEOUT' in os.environ else 1800
+DEFAULT_BACKOFF = scheduling.ExponentialBackoff()
+LATENCY_HINTS = scheduling.LatencyHints('build/latencies.json')
 LOGGER = logger.logger(__name__)
+_DEADLINES = {}
+_ABORTS = {}
+_ABORTS_LOCK = threading.Lock()
 
 class TimeoutException(RuntimeError):
     @staticmethod
-    def giving_up_on(what):
+    def giving_up_on(what, elapsed):
         timestamp = datetime.today().isoformat()
         return TimeoutException(
-            "Cannot find '%s'; Giving up at %s" \
-                    % (what, timestamp)
+            "Cannot find '%s'; Giving up at %s after %.0fs" \
+                    % (what, timestamp, elapsed)
         )
 
 class UnrecoverableException(RuntimeError):
@@ -54,52 +62,44 @@ class BucketFileCheck:
         return _poll(
             lambda: self._is_present(criteria, last_modified_after, **kwargs),
             "object matching criteria %s in bucket %s"+last_modified_suffix,
-            criteria, self._bucket_name
+            criteria, self._bucket_name,
+            id=kwargs['id'],
+            name="bucket %s %s" % (self._bucket_name, self._key)
         )
 
     def _is_present(self, criteria, last_modified_after, **kwargs):
         try:
             id = kwargs['id']
-            bucket = self._s3.Bucket(self._bucket_name)
-            # TODO: necessary?
-            bucket.load()
-            all = bucket.objects.all()
-            if self._prefix:
-                prefix = self._prefix.format(**kwargs)
-                all = all.filter(Prefix=prefix)
-                LOGGER.debug(
-                    "Filtering by prefix %s",
-                    prefix,
-                    extra={'id': id}
-                )
-            for file in all:
-                match = re.match(criteria, file.key)
+            prefix = self._prefix.format(**kwargs) if self._prefix else ''
+            listing = aws.bucket_listing(self._s3, self._bucket_name, prefix)
+            for file in listing.objects():
+                match = re.match(criteria, file['Key'])
                 if match:
                     LOGGER.debug(
                         "Found candidate %s in bucket %s (last modified: %s)",
-                        file.key,
+                        file['Key'],
                         self._bucket_name,
-                        file.last_modified,
+                        file['LastModified'],
                         extra={'id': id}
                     )
                     if last_modified_after:
-                        if file.last_modified.strftime('%s') <= last_modified_after.strftime('%s'):
+                        if file['LastModified'].strftime('%s') <= last_modified_after.strftime('%s'):
                             continue
                     LOGGER.info(
                         "Found %s in bucket %s (last modified: %s)",
-                        file.key,
+                        file['Key'],
                         self._bucket_name,
-                        file.last_modified,
+                        file['LastModified'],
                         extra={'id': id}
                     )
                     if match.groups():
                         LOGGER.info(
                             "Found groups %s in matching the file name %s",
                             match.groupdict(),
-                            file.key,
+                            file['Key'],
                             extra={'id': id}
                         )
-                        return (match.groups(), {'key': file.key})
+                        return (match.groups(), {'key': file['Key']})
                     else:
                         return True
         except SSLError as e:
@@ -142,7 +142,9 @@ class WebsiteArticleCheck:
         article = _poll(
             lambda: self._is_present(id, version, publish),
             "article on website with publish status %s: %s/api/article/%s.%s.json",
-            publish, self._host, id, version
+            publish, self._host, id, version,
+            id=id,
+            name="website publish %s" % publish
         )
         assert article['article-id'] == id, \
                 "The article id does not correspond to the one we were looking for"
@@ -152,7 +154,9 @@ class WebsiteArticleCheck:
         article = _poll(
             lambda: self._is_visible(path, extra=kwargs),
             "article visible on website: %s%s",
-            self._host, path
+            self._host, path,
+            id=kwargs.get('id'),
+            name="website visible"
         )
         return article
 
@@ -160,7 +164,7 @@ class WebsiteArticleCheck:
         template = "%s/api/article/%s.%s.json"
         url = template % (self._host, id, version)
         try:
-            response = requests.get(url, auth=(self._user, self._password))
+            response = sessions.get(url, auth=(self._user, self._password))
             if response.status_code == 200:
                 article = response.json()
                 if article['publish'] is publish:
@@ -180,7 +184,7 @@ class WebsiteArticleCheck:
         template = "%s/%s"
         url = template % (self._host, path)
         try:
-            response = requests.get(url)
+            response = sessions.get(url)
             if response.status_code >= 500:
                 raise UnrecoverableException(response)
             if response.status_code == 200:
@@ -209,10 +213,16 @@ class DashboardArticleCheck:
         return _poll(
             lambda: self._is_last_event_error(id, version, run),
             "having the last event as an error on the article version %s on dashboard: %s/api/article/%s",
-            version, self._host, id
+            version, self._host, id,
+            id=id,
+            name="dashboard error"
         )
 
     def _wait_for_status(self, id, version, status, run=None, run_after=None):
+        name = "dashboard %s" % status
+        if run_after:
+            # waiting for a new run to start takes longer than waiting on a known one
+            name = "%s after a new run" % name
         return _poll(
             lambda: self._is_present(id, version, status, run=run, run_after=run_after),
             lambda: "article version %s in status %s on dashboard (run filter %s, run_after filter %s): %s/api/article/%s",
@@ -221,13 +231,15 @@ class DashboardArticleCheck:
             run,
             run_after,
             self._host,
-            id
+            id,
+            id=id,
+            name=name
         )
 
     def _is_present(self, id, version, status, run=None, run_after=None):
         url = self._article_api(id)
         try:
-            response = requests.get(url, auth=(self._user, self._password), verify=False)
+            response = sessions.get(url, auth=(self._user, self._password), verify=False)
             if response.status_code != 200:
                 return False, "Response code: %s" % response.status_code
             if response.status_code >= 500:
@@ -297,7 +309,7 @@ class DashboardArticleCheck:
         url = self._article_api(id)
         version_key = str(version)
         try:
-            response = requests.get(url, auth=(self._user, self._password), verify=False)
+            response = sessions.get(url, auth=(self._user, self._password), verify=False)
             if response.status_code >= 500:
                 raise UnrecoverableException(response)
             article = response.json()
@@ -323,10 +335,65 @@ class DashboardArticleCheck:
             _log_connection_error(e)
             return False
 
+    def watching_errors(self, id, version, run_after=None):
+        """Returns a context manager that aborts all polling on article `id` as soon as one of its runs reports an error event.
+
+        Only runs of `version` that started after `run_after` are considered"""
+        return DashboardErrorWatcher(self, id, version, run_after)
+
+    def current_errors(self, id, version, run_after=None):
+        "Error events currently reported for article `id`, without polling"
+        url = self._article_api(id)
+        response = sessions.get(url, auth=(self._user, self._password), verify=False)
+        if response.status_code != 200:
+            return []
+        version_contents = self._check_for_version(response.json(), version)
+        if not version_contents:
+            return []
+        runs = version_contents['runs'].values()
+        if run_after:
+            runs = [r for r in runs if datetime.fromtimestamp(r['first-event-timestamp']).strftime('%s') > run_after.strftime('%s')]
+        return [e for r in runs for e in r['events'] if e['event-status'] == 'error']
+
     def _article_api(self, id):
         template = "%s/api/article/%s"
         return template % (self._host, id)
 
+class DashboardErrorWatcher:
+    def __init__(self, dashboard, id, version, run_after, interval=5):
+        self._dashboard = dashboard
+        self._id = id
+        self._version = version
+        self._run_after = run_after
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="dashboard-errors-%s" % id)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        reset_abort(self._id)
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            try:
+                errors = self._dashboard.current_errors(self._id, self._version, self._run_after)
+                if errors:
+                    LOGGER.error("Dashboard reported errors, aborting: %s", pformat(errors), extra={'id': self._id})
+                    abort(self._id, "At least one error event was reported for the run.\n%s" % pformat(errors))
+                    return
+            except ConnectionError as e:
+                _log_connection_error(e)
+            except Exception as e:  # pylint: disable=broad-except
+                # a watcher that died would let the checks poll until their timeout
+                LOGGER.warning("Could not read errors from the dashboard, will retry: %s", e, extra={'id': self._id})
+            self._stopped.wait(self._interval)
+
 class LaxArticleCheck:
     def __init__(self, host):
         self._host = host
@@ -335,7 +402,9 @@ class LaxArticleCheck:
         return _poll(
             lambda: self._is_present(id, version),
             "article version %s in lax: %s/api/v1/article/10.7554/eLife.%s/version",
-            version, self._host, id
+            version, self._host, id,
+            id=id,
+            name="lax published"
         )
 
     def _is_present(self, id, version):
@@ -344,7 +413,7 @@ class LaxArticleCheck:
         version_key = str(version)
         # TODO: remove verify=False
         try:
-            response = requests.get(url, verify=False)
+            response = sessions.get(url, verify=False)
             if response.status_code != 200:
                 return False
             if response.status_code >= 500:
@@ -399,13 +468,13 @@ class ApiCheck:
 
     def _list_api(self, path, entity):
         url = "%s%s" % (self._host, path)
-        response = requests.get(url, headers=self._base_headers({'Accept': 'application/vnd.elife.%s-list+json; version=1' % entity}))
+        response = sessions.get(url, headers=self._base_headers({'Accept': 'application/vnd.elife.%s-list+json; version=1' % entity}))
         LOGGER.info("Found %s: %s", url, response.status_code)
         return self._ensure_sane_response(response, url)
 
     def _item_api(self, path, entity):
         url = "%s%s" % (self._host, path)
-        response = requests.get(url, headers=self._base_headers({'Accept': 'application/vnd.elife.%s+json; version=1' % entity}))
+        response = sessions.get(url, headers=self._base_headers({'Accept': 'application/vnd.elife.%s+json; version=1' % entity}))
         LOGGER.info("Found %s: %s", url, response.status_code)
         return self._ensure_sane_response(response, url)
 
@@ -413,14 +482,14 @@ class ApiCheck:
         versioned_url = "%s/articles/%s/versions/%s" % (self._host, id, version)
         # we should pass 'Accept': 'application/vnd.elife.article-poa+json,application/vnd.elife.article-vor+json'
         # if that works... requests does not support a multidict, it seems
-        response = requests.get(versioned_url, headers=self._base_headers())
+        response = sessions.get(versioned_url, headers=self._base_headers())
         body = self._ensure_sane_response(response, versioned_url)
         assert body['version'] == version, \
             ("Version in body %s not consistent with requested version %s" % (body['version'], version))
         LOGGER.info("Found article version %s on api: %s", body['version'], versioned_url, extra={'id': id})
 
         latest_url = "%s/articles/%s" % (self._host, id)
-        response = requests.get(latest_url, headers=self._base_headers())
+        response = sessions.get(latest_url, headers=self._base_headers())
         body = self._ensure_sane_response(response, latest_url)
         assert body['version'] == version, \
             ("We were expecting /article/%s to be at version %s now" % (id, version))
@@ -431,7 +500,7 @@ class ApiCheck:
         "Article must be immediately present with this version, but will poll until the constraints (fields with certain values) are satisfied"
         latest_url = "%s/articles/%s" % (self._host, id)
         def _is_ready():
-            response = requests.get(latest_url, headers=self._base_headers())
+            response = sessions.get(latest_url, headers=self._base_headers())
             if response.status_code == 404:
                 LOGGER.debug("%s: 404", latest_url)
                 return False
@@ -448,26 +517,28 @@ class ApiCheck:
         return _poll(
             _is_ready,
             "%s to satisfy constraints %s",
-            latest_url, constraints
+            latest_url, constraints,
+            id=id,
+            name="api article"
         )
 
     def related_articles(self, id):
         url = "%s/articles/%s/related" % (self._host, id)
-        response = requests.get(url, headers=self._base_headers())
+        response = sessions.get(url, headers=self._base_headers())
         assert response.status_code == 200, "%s is not 200 but %s: %s" % (url, response.status_code, response.content)
         LOGGER.info("Found related articles of %s on api: %s", id, url, extra={'id': id})
         return response.json()
 
     def search(self, for_input):
         url = "%s/search?for=%s" % (self._host, for_input)
-        response = requests.get(url, headers=self._base_headers())
+        response = sessions.get(url, headers=self._base_headers())
         return self._ensure_sane_response(response, url)
 
     def wait_search(self, word):
         "Returns as soon as there is one result"
         search_url = "%s/search?for=%s" % (self._host, word)
         def _is_ready():
-            response = requests.get(search_url, headers=self._base_headers())
+            response = sessions.get(search_url, headers=self._base_headers())
             body = self._ensure_sane_response(response, search_url)
             if len(body['items']) == 0:
                 return False
@@ -478,14 +549,15 @@ class ApiCheck:
         return _poll(
             _is_ready,
             "%s returning at least 1 result",
-            search_url
+            search_url,
+            name="api search"
         )
 
     def wait_recommendations(self, id):
         "Returns as soon as there is one result"
         recommendations_url = "%s/recommendations/article/%s" % (self._host, id)
         def _is_ready():
-            response = requests.get(recommendations_url, headers=self._base_headers({'Accept': 'application/vnd.elife.recommendations+json; version=1'}))
+            response = sessions.get(recommendations_url, headers=self._base_headers({'Accept': 'application/vnd.elife.recommendations+json; version=1'}))
             body = self._ensure_sane_response(response, recommendations_url)
             if len(body['items']) == 0:
                 return False
@@ -496,7 +568,9 @@ class ApiCheck:
         return _poll(
             _is_ready,
             "%s returning at least 1 result",
-            recommendations_url
+            recommendations_url,
+            id=id,
+            name="api recommendations"
         )
 
     def _ensure_sane_response(self, response, url):
@@ -528,27 +602,29 @@ class JournalCheck:
         if version:
             url = "%sv%s" % (url, version)
         LOGGER.info("Loading %s", url, extra={'id':id})
-        response = self._persistently_get(url)
+        response = sessions.get(url)
         _assert_status_code(response, 200, url)
-        _assert_all_resources_of_page_load(response.content, self._host, id=id)
+        page = pages.Page(response.content)
+        _assert_all_resources_of_page_load(page, self._host, id=id)
         figures_link_selector = 'view-selector__link--figures'
-        figures_link = self._link(response.content, figures_link_selector)
+        figures_link = page.link(figures_link_selector)
         if has_figures:
             assert figures_link is not None, "Cannot find figures link with selector %s" % figures_link_selector
             figures_url = _build_url(figures_link, self._host)
             LOGGER.info("Loading %s", figures_url, extra={'id':id})
-            response = self._persistently_get(figures_url)
+            response = sessions.get(figures_url)
             _assert_status_code(response, 200, figures_url)
-            _assert_all_resources_of_page_load(response.content, self._host, id=id)
+            _assert_all_resources_of_page_load(pages.Page(response.content), self._host, id=id)
         return response.content
 
     def search(self, query, count=1):
         url = _build_url("/search?for=%s" % query, self._host)
         LOGGER.info("Loading %s", url)
-        response = requests.get(url)
+        response = sessions.get(url)
         _assert_status_code(response, 200, url)
-        _assert_all_resources_of_page_load(response.content, self._host)
-        _assert_count(response.content, class_='teaser', count=count)
+        page = pages.Page(response.content)
+        _assert_all_resources_of_page_load(page, self._host)
+        _assert_count(page, class_='teaser', count=count)
 
     def homepage(self):
         return self.generic("/")
@@ -557,40 +633,25 @@ class JournalCheck:
         return self.generic("/magazine")
 
     def generic(self, path):
-        url = _build_url(path, self._host)
-        LOGGER.info("Loading %s", url)
-        response = requests.get(url)
-        _assert_status_code(response, 200, url)
-        match = re.match("^"+self._host, response.url)
-        if match:
-            _assert_all_resources_of_page_load(response.content, self._host)
-        return response.content
+        (body, _) = self._generic_page(path)
+        return body
 
     def listing(self, path):
-        body = self.generic(path)
-        soup = BeautifulSoup(body, "html.parser")
-        teaser_a_tags = soup.select("div.teaser .teaser__header_text_link")
-        teaser_links = [a['href'] for a in teaser_a_tags]
+        (_, page) = self._generic_page(path)
+        teaser_links = page.teaser_links()
         LOGGER.info("Loaded %s, found links: %s", path, teaser_links)
         return teaser_links
 
-    def _persistently_get(self, url):
-        response = requests.get(url)
-        # intended behavior at the moment: if the page is too slow to load,
-        # timeouts will cut it (a CDN may serve a stale version if it has it)
-        if response.status_code == 504:
-            response = requests.get(url)
-        return response
-
-    def _link(self, body, class_name):
-        """Finds out where the link selected with CSS class_name points to.
-
-        May return None if there is no actual link with this class on the page"""
-        soup = BeautifulSoup(body, "html.parser")
-        links = soup.find_all("a", class_=class_name)
-        assert len(links) <= 1, \
-               ("Found too many links for the class name %s: %s" % (class_name, links))
-        return links[0]['href'] if len(links) == 1 else None
+    def _generic_page(self, path):
+        url = _build_url(path, self._host)
+        LOGGER.info("Loading %s", url)
+        response = sessions.get(url)
+        _assert_status_code(response, 200, url)
+        page = pages.Page(response.content)
+        match = re.match("^"+self._host, response.url)
+        if match:
+            _assert_all_resources_of_page_load(page, self._host)
+        return (response.content, page)
 
 
 class GithubCheck:
@@ -604,12 +665,14 @@ class GithubCheck:
         _poll(
             lambda: self._is_present(url, text_match, id),
             "article on github with URL %s existing" + error_message_suffix,
-            url
+            url,
+            id=id,
+            name="github article"
         )
 
     def _is_present(self, url, text_match, id):
         try:
-            response = requests.get(url)
+            response = sessions.get(url)
             if response.status_code == 200:
                 if text_match:
                     if text_match in response.content:
@@ -623,9 +686,9 @@ class GithubCheck:
             _log_connection_error(e)
         return False
 
-def _poll(action_fn, error_message, *error_message_args):
+def _poll(action_fn, error_message, *error_message_args, **kwargs):
     """
-    Poll until action_fn returns something truthy. After GLOBAL_TIMEOUT throws an exception.
+    Poll until action_fn returns something truthy. After GLOBAL_TIMEOUT, or when the deadline of the article expires, throws an exception.
 
     action_fn may return:
     - a tuple: first element is a result (truthy or falsy), second element any detail
@@ -633,30 +696,81 @@ def _poll(action_fn, error_message, *error_message_args):
 
     error_message may be:
     - a string to be formatted with error_message_args
-    - a callable returning such a string"""
-    details = {'last_seen': None}
-    def wrapped_action_fn():
+    - a callable returning such a string
+
+    kwargs may contain:
+    - id: the article being checked, whose deadline applies
+    - name: the kind of check, used to learn how long it usually takes
+    - backoff: the strategy for waiting between attempts, DEFAULT_BACKOFF otherwise
+
+    Polling stops with an UnrecoverableException as soon as abort() is called for the article,
+    or the cancellation of the current thread happens (see scheduling.cancellable())"""
+    id = kwargs.get('id')
+    name = kwargs.get('name')
+    backoff = kwargs.get('backoff', DEFAULT_BACKOFF)
+    timeout = GLOBAL_TIMEOUT
+    if id in _DEADLINES:
+        timeout = min(timeout, _DEADLINES[id].remaining())
+    expected = LATENCY_HINTS.expected(name) if name else None
+    cancellations = [c for c in [scheduling.current_cancellation(), _abort_of(id) if id else None] if c]
+    last_seen = None
+    delays = backoff.delays()
+    start = time.time()
+    while True:
+        for cancellation in cancellations:
+            if cancellation.cancelled():
+                raise UnrecoverableException(cancellation.reason())
         possible_result = action_fn()
         if isinstance(possible_result, tuple) and len(possible_result) == 2:
-            details['last_seen'] = possible_result[1]
-            return possible_result[0]
+            last_seen = possible_result[1]
+            result = possible_result[0]
         else:
-            return possible_result
+            result = possible_result
+        elapsed = time.time() - start
+        if result:
+            if name:
+                LATENCY_HINTS.record(name, elapsed)
+            return result
+        if elapsed >= timeout:
+            break
+        delay = scheduling.next_delay(next(delays), elapsed, expected, backoff.maximum())
+        scheduling.sleep(min(delay, timeout - elapsed), cancellations)
+    if callable(error_message):
+        error_message_template = error_message()
+    else:
+        error_message_template = error_message
+    built_error_message = error_message_template % tuple(error_message_args)
+    built_error_message = built_error_message + "\n" + pformat(last_seen)
+    raise TimeoutException.giving_up_on(built_error_message, elapsed)
+
+@contextmanager
+def deadline(id, seconds=PIPELINE_TIMEOUT):
+    """Bounds the time spent polling for article `id`, across all the checks made inside this block.
+
+    Nested blocks for the same article keep the outer deadline"""
+    if id in _DEADLINES:
+        yield _DEADLINES[id]
+        return
+    _DEADLINES[id] = scheduling.Deadline(seconds)
     try:
-        return polling.poll(
-            wrapped_action_fn,
-            timeout=GLOBAL_TIMEOUT,
-            step=5
-        )
-    except polling.TimeoutException:
-        if callable(error_message):
-            error_message_template = error_message()
-        else:
-            error_message_template = error_message
-        built_error_message = error_message_template % tuple(error_message_args)
-        if 'last_seen' in details:
-            built_error_message = built_error_message + "\n" + pformat(details['last_seen'])
-        raise TimeoutException.giving_up_on(built_error_message)
+        yield _DEADLINES[id]
+    finally:
+        _DEADLINES.pop(id, None)
+
+def _abort_of(id):
+    with _ABORTS_LOCK:
+        if id not in _ABORTS:
+            _ABORTS[id] = scheduling.Cancellation()
+        return _ABORTS[id]
+
+def abort(id, reason):
+    "Makes all the current and future polling on article `id` fail, until reset_abort() is called"
+    _abort_of(id).cancel(reason)
+
+def reset_abort(id):
+    "Polling already aborted stays aborted, but new polling on article `id` can start"
+    with _ABORTS_LOCK:
+        _ABORTS.pop(id, None)
 
 def _log_connection_error(e):
     LOGGER.debug("Connection error, will retry: %s", e)
@@ -665,59 +779,79 @@ def _assert_status_code(response, expected_status_code, url):
     assert response.status_code == expected_status_code, \
         "Response from %s had status %d, body %s" % (url, response.status_code, response.content)
 
-RESOURCE_CACHE = {}
-
-def _assert_all_resources_of_page_load(html_content, host, **extra):
-    """Checks that all <script>, <link>, <video>, <source>, <srcset> load, by issuing HEAD requests that must give 200 OK.
-
-    Returns the BeautifulSoup for reuse"""
-    def _srcset_values(srcset):
-        values = []
-        for candidate_string in [s.strip() for s in srcset.split(",")]:
-            url_and_maybe_descriptors = candidate_string.split(" ")
-            values.append(url_and_maybe_descriptors[0])
-            return values
-    def _resources_from(soup):
-        resources = []
-        for img in soup.find_all("img"):
-            resources.append(img.get("src"))
-            srcset = img.get("srcset")
-            if srcset:
-                resources.extend(_srcset_values(srcset))
-        for script in soup.find_all("script"):
-            if script.get("src"):
-                resources.append(script.get("src"))
-        for link in soup.find_all("link"):
-            resources.append(link.get("href"))
-        for video in soup.find_all("video"):
-            resources.append(video.get("poster"))
-        for media_source in soup.find_all("source"):
-            srcset = media_source.get("srcset")
-            if srcset:
-                resources.extend(_srcset_values(srcset))
-        return resources
-    soup = BeautifulSoup(html_content, "html.parser")
-    resources = _resources_from(soup)
+# shared by all processes, static assets only need to be verified once per run
+RESOURCE_CACHE = cache.ResourceCache('build/resources.sqlite', ttl=3600, max_entries=100000)
+RESOURCE_CONCURRENCY = 10
+SLOWEST_RESOURCES = 5
+_RESOURCE_EXECUTOR = ThreadPoolExecutor(max_workers=RESOURCE_CONCURRENCY)
+_RESOURCE_LOADS = {}
+_RESOURCE_LOADS_LOCK = threading.Lock()
+
+def _assert_all_resources_of_page_load(page, host, **extra):
+    """Checks that all <script>, <link>, <video>, <source>, <srcset> load, by issuing concurrent HEAD requests that must give 200 OK.
+
+    Returns the Page for reuse"""
+    resources = page.resources()
     LOGGER.info("Found resources %s", pformat(resources), extra=extra)
+    urls = []
     for path in resources:
         if path is None:
             continue
         url = _build_url(path, host)
-        if url in RESOURCE_CACHE:
-            LOGGER.debug("Cached %s: %s", url, RESOURCE_CACHE[url], extra=extra)
-        else:
-            LOGGER.debug("Loading resource %s", url, extra=extra)
-            response = requests.head(url)
-            _assert_status_code(response, 200, url)
-            RESOURCE_CACHE[url] = response.status_code
-    return soup
-
-def _assert_count(html_content, class_, count):
-    """Checks how many elements are in the page.
-
-    Returns the BeautifulSoup for reuse"""
-    soup = BeautifulSoup(html_content, "html.parser")
-    resources = len(soup.find_all(True, class_=class_))
+        if url not in urls:
+            urls.append(url)
+    loads = _load_resources(urls, extra)
+    timings = []
+    for url, load in loads.items():
+        (response, duration) = load.result()
+        _assert_status_code(response, 200, url)
+        timings.append((duration, url))
+    slowest = ["%s (%.2fs)" % (url, duration) for (duration, url) in sorted(timings, reverse=True)[:SLOWEST_RESOURCES]]
+    LOGGER.info(
+        "Loaded %d resources, %d were cached; slowest: %s",
+        len(urls),
+        len(urls) - len(loads),
+        slowest,
+        extra=extra
+    )
+    return page
+
+def _load_resources(urls, extra):
+    """Starts loading the urls that have not been loaded yet, unless another page is already loading them.
+
+    Returns a dictionary of futures by url"""
+    loads = {}
+    # the cache is shared with other processes, looking it up may wait on them
+    uncached_urls = []
+    for url in urls:
+        cached_status_code = RESOURCE_CACHE.get(url)
+        if cached_status_code is not None:
+            LOGGER.debug("Cached %s: %s", url, cached_status_code, extra=extra)
+            continue
+        uncached_urls.append(url)
+    with _RESOURCE_LOADS_LOCK:
+        for url in uncached_urls:
+            if url not in _RESOURCE_LOADS:
+                LOGGER.debug("Loading resource %s", url, extra=extra)
+                _RESOURCE_LOADS[url] = _RESOURCE_EXECUTOR.submit(_load_resource, url)
+            loads[url] = _RESOURCE_LOADS[url]
+    return loads
+
+def _load_resource(url):
+    try:
+        start = time.time()
+        response = sessions.head(url)
+        duration = time.time() - start
+        if response.status_code == 200:
+            RESOURCE_CACHE.put(url, response.status_code)
+        return (response, duration)
+    finally:
+        with _RESOURCE_LOADS_LOCK:
+            del _RESOURCE_LOADS[url]
+
+def _assert_count(page, class_, count):
+    "Checks how many elements are in the page"
+    resources = page.count(class_)
     assert resources == count, ("There are only %d %s elements" % (resources, class_))
 
 def _build_url(path, host):
@@ -726,88 +860,88 @@ def _build_url(path, host):
     assert path.startswith("/"), ("I found a non-absolute path %s and I don't know how to load it" % path)
     return "%s%s" % (host, path)
 
-EIF = BucketFileCheck(
+EIF = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_eif'],
     '{id}.{version}/(?P<run>.*)/elife-{id}-v{version}.json',
     '{id}.{version}/'
-)
-ARCHIVE = BucketFileCheck(
+))
+ARCHIVE = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_archive'],
     # notice {{6}} is the escaping for {6} in the regex,
     # it should not be substituted
     'elife-{id}-(poa|vor)-v{version}-20[0-9]{{12}}.zip',
     'elife-{id}-'
-)
-WEBSITE = WebsiteArticleCheck(
+))
+WEBSITE = lazy.Lazy(lambda: WebsiteArticleCheck(
     host=SETTINGS['website_host'],
     user=SETTINGS['website_user'],
     password=SETTINGS['website_password']
-)
-IMAGES_BOT_CDN = BucketFileCheck(
+))
+IMAGES_BOT_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_cdn'],
     '{id}/elife-{id}-{figure_name}-v{version}.jpg',
-    '{id}/elife-{id}-{figure_name}-v{version}.jpg'
-)
-IMAGES_PUBLISHED_CDN = BucketFileCheck(
+    '{id}/'
+))
+IMAGES_PUBLISHED_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_published'],
     'articles/{id}/elife-{id}-{figure_name}-v{version}.jpg',
-    'articles/{id}/elife-{id}-{figure_name}-v{version}.jpg'
-)
-XML_PUBLISHED_CDN = BucketFileCheck(
+    'articles/{id}/'
+))
+XML_PUBLISHED_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_published'],
     'articles/{id}/elife-{id}-v{version}.xml',
-    'articles/{id}/elife-{id}-v{version}.xml'
-)
-XML_DOWNLOAD_PUBLISHED_CDN = BucketFileCheck(
+    'articles/{id}/'
+))
+XML_DOWNLOAD_PUBLISHED_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_published'],
     'articles/{id}/elife-{id}-v{version}-download.xml',
-    'articles/{id}/elife-{id}-v{version}-download.xml'
-)
-PDF_BOT_CDN = BucketFileCheck(
+    'articles/{id}/'
+))
+PDF_BOT_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_cdn'],
     '{id}/elife-{id}-v{version}.pdf',
-    '{id}/elife-{id}-v{version}.pdf'
-)
-PDF_PUBLISHED_CDN = BucketFileCheck(
+    '{id}/'
+))
+PDF_PUBLISHED_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_published'],
     'articles/{id}/elife-{id}-v{version}.pdf',
-    'articles/{id}/elife-{id}-v{version}.pdf'
-)
-PDF_DOWNLOAD_PUBLISHED_CDN = BucketFileCheck(
+    'articles/{id}/'
+))
+PDF_DOWNLOAD_PUBLISHED_CDN = lazy.Lazy(lambda: BucketFileCheck(
     aws.S3,
     SETTINGS['bucket_published'],
     'articles/{id}/elife-{id}-v{version}-download.pdf',
-    'articles/{id}/elife-{id}-v{version}-download.pdf'
-)
-DASHBOARD = DashboardArticleCheck(
+    'articles/{id}/'
+))
+DASHBOARD = lazy.Lazy(lambda: DashboardArticleCheck(
     host=SETTINGS['dashboard_host'],
     user=SETTINGS['dashboard_user'],
     password=SETTINGS['dashboard_password']
-)
-LAX = LaxArticleCheck(
+))
+LAX = lazy.Lazy(lambda: LaxArticleCheck(
     host=SETTINGS['lax_host']
-)
-API = ApiCheck(
+))
+API = lazy.Lazy(lambda: ApiCheck(
     host=SETTINGS['api_gateway_host']
-)
-API_PREVIEW = ApiCheck(
+))
+API_PREVIEW = lazy.Lazy(lambda: ApiCheck(
     host=SETTINGS['api_gateway_host'],
     authorization=SETTINGS['api_gateway_authorization']
-)
-JOURNAL = JournalCheck(
+))
+JOURNAL = lazy.Lazy(lambda: JournalCheck(
     host=SETTINGS['journal_host']
-)
-JOURNAL_CDN = JournalCheck(
+))
+JOURNAL_CDN = lazy.Lazy(lambda: JournalCheck(
     host=SETTINGS['journal_cdn_host']
-)
-GITHUB_XML = GithubCheck(
+))
+GITHUB_XML = lazy.Lazy(lambda: GithubCheck(
     repo_url=SETTINGS['github_article_xml_repository_url']
-)
+))
@@ -1,47 +1,214 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+import fcntl
 import glob
+import json
 import os
 from os import path
 import random
 import re
 import shutil
+import struct
+import threading
+import time
 import zipfile
 
 import jinja2
-from spectrum import logger
+from spectrum import logger, payloads
 from spectrum.config import COMMON
 
 LOGGER = logger.logger(__name__)
+TEMPLATES_DIRECTORY = 'spectrum/templates'
+JINJA_BYTECODE_DIRECTORY = 'build/jinja'
+
+def _jinja_environment():
+    """Compiled templates are cached in memory until their file is modified.
+
+    Their bytecode is also cached on disk, so that parallel processes compile each template only once"""
+    if not path.exists(JINJA_BYTECODE_DIRECTORY):
+        try:
+            os.mkdir(JINJA_BYTECODE_DIRECTORY)
+        except OSError:
+            # another process created it in the meantime
+            pass
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIRECTORY),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(JINJA_BYTECODE_DIRECTORY),
+        auto_reload=True
+    )
+
+class TemplateIndex:
+    """Everything generation needs to know about the templates, without listing them at each call.
+
+    Cached in a file, and rebuilt when any template directory has been modified"""
+    def __init__(self, directory, filename):
+        self._directory = directory
+        self._filename = filename
+        self._templates = None
+
+    def template(self, template_id):
+        "Returns a dict with id, kind, directory, files, figure_names and has_pdf"
+        candidates = [t for t in self.all() if t['id'] == template_id]
+        assert len(candidates) == 1, "Found multiple candidate templates: %s" % [t['directory'] for t in candidates]
+        return candidates[0]
+
+    def all(self):
+        if self._templates is None:
+            index = self._load()
+            if index is None or index['mtimes'] != self._mtimes():
+                index = self._build()
+                self._save(index)
+            self._templates = index['templates']
+        return self._templates
+
+    def _mtimes(self):
+        mtimes = {'': os.stat(self._directory).st_mtime}
+        for name in os.listdir(self._directory):
+            if name.startswith('elife-'):
+                mtimes[name] = os.stat(path.join(self._directory, name)).st_mtime
+        return mtimes
+
+    def _build(self):
+        mtimes = self._mtimes()
+        templates = [_index_template(path.join(self._directory, name)) for name in sorted(mtimes) if name]
+        LOGGER.info("Indexed %d templates in %s", len(templates), self._directory)
+        return {'mtimes': mtimes, 'templates': templates}
+
+    def _load(self):
+        if not path.exists(self._filename):
+            return None
+        try:
+            with open(self._filename) as index_file:
+                return json.load(index_file)
+        except ValueError as e:
+            LOGGER.warning("Ignoring corrupted template index in %s: %s", self._filename, e)
+            return None
+
+    def _save(self, index):
+        temporary_filename = "%s.%s.tmp" % (self._filename, os.getpid())
+        with open(temporary_filename, 'w') as index_file:
+            json.dump(index, index_file, indent=4, sort_keys=True)
+        os.rename(temporary_filename, self._filename)
+
+def _index_template(template_directory):
+    match = re.match(r'.*/elife-(\d+)-(vor|poa)-(r|v)\d+$', template_directory)
+    assert match is not None, ("Bad name for template directory %s" % template_directory)
+    (template_id, kind, _) = match.groups()
+    files = []
+    figure_names = []
+    for name in sorted(os.listdir(template_directory)):
+        files.append({
+            'name': name,
+            'size': os.stat(path.join(template_directory, name)).st_size,
+            'jinja': name.endswith('.jinja'),
+        })
+        if _figure_name(name):
+            figure_names.append(_figure_name(name))
+    return {
+        'id': template_id,
+        'kind': kind,
+        'directory': template_directory,
+        'files': files,
+        'figure_names': figure_names,
+        'has_pdf': any(f['name'].endswith('.pdf') for f in files),
+    }
+
+def _figure_name(filename):
+    match = re.match(r"elife-\d+-(.+).tif", filename)
+    return match.groups()[0] if match else None
+
+class ArticleIdSequence:
+    """Prefixes of article ids, made of a block drawn at random by each process followed by a counter.
+
+    Blocks are registered in a file shared by the processes of a run, so that no two of them draw the same one"""
+    def __init__(self, filename, maximum_prefix, block_size=100000):
+        self._filename = filename
+        self._block_size = block_size
+        self._blocks = maximum_prefix // block_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._block = None
+        self._counter = 0
+
+    def next(self):
+        with self._lock:
+            # processes forked after generating an id must not reuse the block of their parent
+            if self._pid != os.getpid() or self._counter == self._block_size:
+                self._pid = os.getpid()
+                self._block = self._draw_block()
+                self._counter = 0
+            prefix = self._block * self._block_size + self._counter
+            self._counter = self._counter + 1
+            return prefix
+
+    def _draw_block(self):
+        with open(self._filename + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                drawn = set()
+                if path.exists(self._filename):
+                    with open(self._filename) as blocks_file:
+                        drawn = set(int(line) for line in blocks_file if line.strip())
+                block = random.randrange(1, self._blocks)
+                while block in drawn:
+                    block = random.randrange(1, self._blocks)
+                with open(self._filename, 'a') as blocks_file:
+                    blocks_file.write("%d\n" % block)
+                return block
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+JINJA = _jinja_environment()
+PAYLOADS = payloads.PayloadStore('%s/spectrum-payloads' % COMMON['tmp'])
+TEMPLATES = TemplateIndex(TEMPLATES_DIRECTORY, 'build/templates.json')
+# 2^63 - 1 = 9223372036854775807 is the maximum id
+ARTICLE_IDS = ArticleIdSequence('build/article-id-blocks', maximum_prefix=92233720368546)
 
 def generate_article_id(template_id):
-    # 2^63 - 1 = 9223372036854775807 is the maximum id
-    maximum_prefix = 92233720368546
-    prefix = random.randrange(1, maximum_prefix + 1)
     # good until template_id reaches 100000
-    return str(prefix * 100000 + int(template_id))
+    return str(ARTICLE_IDS.next() * 100000 + int(template_id))
+
+def article_zip(template_id, template_variables=None, id=None, additional_files=None):
+    """additional_files are added to the ones of the template, as a dict of their names to the files to copy.
 
-def article_zip(template_id, template_variables=None):
+    Like the template files, their names contain the template id, which is replaced with the article id"""
     if template_variables is None:
         template_variables = {}
-    (template, kind) = _choose_template(template_id)
-    id = generate_article_id(template_id)
-    generated_article_directory = '%s/elife-%s-%s-r1' % (COMMON['tmp'], id, kind)
-    os.mkdir(generated_article_directory)
-    generated_files = []
-    for file in glob.glob(template + "/*"):
-        generated_file = _generate(file, id, generated_article_directory, template_id, template_variables)
-        generated_files.append(generated_file)
+    if additional_files is None:
+        additional_files = {}
+    template = TEMPLATES.template(template_id)
+    if id is None:
+        id = generate_article_id(template_id)
+    # only created on disk if an operation needs it, the zip is generated directly
+    generated_article_directory = '%s/elife-%s-%s-r1' % (COMMON['tmp'], id, template['kind'])
     zip_filename = generated_article_directory + '.zip'
-    figure_names = []
+    sources = [(template_file['name'], path.join(template['directory'], template_file['name'])) for template_file in template['files']]
+    sources.extend(sorted(additional_files.items()))
     with zipfile.ZipFile(zip_filename, 'w') as zip_file:
-        for generated_file in generated_files:
-            zip_file.write(generated_file, path.basename(generated_file))
-            match = re.match(r".*/elife-\d+-(.+).tif", generated_file)
-            if match:
-                figure_names.append(match.groups()[0])
+        for (name, file) in sources:
+            _generate(file, name, id, zip_file, template_id, template_variables)
+    figure_names = list(template['figure_names']) + [_figure_name(name) for name in sorted(additional_files) if _figure_name(name)]
+    has_pdf = template['has_pdf'] or any(name.endswith('.pdf') for name in additional_files)
     LOGGER.info("Generated %s with figures %s", zip_filename, figure_names, extra={'id': id})
-    has_pdf = len(glob.glob(template + "/*.pdf")) >= 1
     return ArticleZip(id, zip_filename, generated_article_directory, revision=1, version=1, figure_names=figure_names, has_pdf=has_pdf)
 
+def article_zips(template_ids, count, template_variables=None, processes=None):
+    """Generates count articles in parallel, cycling through template_ids.
+
+    Yields each ArticleZip as soon as it is ready, in no particular order"""
+    for template_id in set(template_ids):
+        # fails early on missing templates, and the index is inherited by the worker processes
+        TEMPLATES.template(template_id)
+    assigned_templates = [template_ids[i % len(template_ids)] for i in range(count)]
+    ids = [generate_article_id(template_id) for template_id in assigned_templates]
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(article_zip, template_id, template_variables, id) for (template_id, id) in zip(assigned_templates, ids)]
+        for future in as_completed(futures):
+            yield future.result()
+    elapsed = time.time() - start
+    LOGGER.info("Generated %d articles in %.2f seconds: %.1f articles/s", count, elapsed, count / elapsed if elapsed else float('inf'))
+
 def clean():
     for entry in glob.glob('%s/elife*' % COMMON['tmp']):
         if path.isdir(entry):
@@ -50,6 +217,7 @@ def clean():
         else:
             os.remove(entry)
             LOGGER.info("Deleted file %s", entry)
+    PAYLOADS.clean()
 
 def all_stored_articles():
     """Returns all articles available as test inputs.
@@ -58,47 +226,65 @@ def all_stored_articles():
     blacklist = ['19532', '06847', '22661']
     # we are unsure if the format is right, let's skip it for now
     blacklist.append('03318')
-    articles = []
-    for template_directory in glob.glob('spectrum/templates/elife-*'):
-        match = re.match(r".*/elife-(\d+)-.+", template_directory)
-        assert match is not None
-        assert len(match.groups()) == 1
-        article_id = match.groups()[0]
-        if article_id in blacklist:
-            continue
-        articles.append(article_id)
+    # only meaningful with the variables passed by the synthesizer
+    blacklist.append('99999')
+    articles = [str(template['id']) for template in TEMPLATES.all() if template['id'] not in blacklist]
     articles.sort()
     return articles
 
-def _choose_template(template_id):
-    templates_pattern = './spectrum/templates/elife-%s-*-*' % template_id
-    templates_found = glob.glob(templates_pattern)
-    assert len(templates_found) == 1, "Found multiple candidate templates: %s" % templates_found
-    chosen = templates_found[0]
-    match = re.match(r'.*/elife-\d+-(vor|poa)-(r|v)\d+', chosen)
-    assert match is not None, ("Bad name for template directory %s" % chosen)
-    assert len(match.groups()) == 2
-    kind = match.groups()[0] # vor or poa
-    return (chosen, kind)
-
-
-def _generate(filename, id, generated_article_directory, template_id, template_variables):
-    filename_components = path.splitext(filename)
-    generated_filename = path.basename(filename).replace(template_id, id)
-    target = generated_article_directory + '/' + generated_filename
+def _generate(filename, name, id, zip_file, template_id, template_variables):
+    "Writes the generated version of filename into zip_file, returning its name in there"
+    filename_components = path.splitext(name)
+    generated_filename = name.replace(template_id, id)
     assert len(filename_components) == 2
     extension = filename_components[1]
     if extension == '.jinja':
-        with open(filename, 'r') as template_file:
-            data = template_file.read().decode('UTF-8')
-        template = jinja2.Template(data)
+        template = JINJA.get_template(path.relpath(filename, TEMPLATES_DIRECTORY))
         content = template.render(article={'id': id}, **template_variables)
-        target = target.replace('.jinja', '')
-        with open(target, 'w') as target_file:
-            target_file.write(content.encode('utf-8'))
+        generated_filename = generated_filename.replace('.jinja', '')
+        zip_file.writestr(generated_filename, content.encode('utf-8'))
     else:
-        shutil.copy(filename, target)
-    return target
+        # binaries are the same in every article generated from the template
+        PAYLOADS.write(zip_file, filename, generated_filename, owner=path.basename(zip_file.filename))
+    return generated_filename
+
+def _new_zip_info(info):
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.external_attr = info.external_attr
+    return new_info
+
+# positions of the lengths of variable fields inside a zip local file header
+_FILE_HEADER_FILENAME_LENGTH = 10
+_FILE_HEADER_EXTRA_FIELD_LENGTH = 11
+
+def _copy_zip_entry(source, target, info):
+    """Copies an entry from the source ZipFile to the target one as it is.
+
+    The compressed bytes are not decompressed, checked or recompressed"""
+    source.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))
+    source.fp.seek(header[_FILE_HEADER_FILENAME_LENGTH] + header[_FILE_HEADER_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    copied_info = copy.copy(info)
+    # CRC and sizes are already known and go in the header, no data descriptor
+    copied_info.flag_bits &= ~0x08
+    copied_info.header_offset = target.fp.tell()
+    target.fp.write(copied_info.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source.fp.read(min(remaining, 1024 * 1024))
+        assert chunk, "Unexpected end of %s while copying %s" % (source.filename, info.filename)
+        target.fp.write(chunk)
+        remaining = remaining - len(chunk)
+    target.filelist.append(copied_info)
+    target.NameToInfo[copied_info.filename] = copied_info
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        # e.g. on a different filesystem
+        shutil.copy(source, target)
 
 class ArticleZip:
     def __init__(self, id, filename, directory, revision, version, figure_names=None, has_pdf=False):
@@ -138,36 +324,64 @@ class ArticleZip:
             new_version = self._version
         new_revision = self._revision + 1
         new_filename = re.sub(r'-(r|v)\d+.zip$', ('-r%s.zip' % new_revision), self._filename)
-        shutil.copy(self._filename, new_filename)
         new_directory = re.sub(r'-(r|v)\d+$', ('-r%s' % new_revision), self._directory)
-        shutil.copytree(self._directory, new_directory)
-        return ArticleZip(self._id, new_filename, new_directory, new_revision, new_version, self._figure_names, self._has_pdf)
+        return self._derive(new_filename, new_directory, new_revision, new_version)
 
     def new_version(self, version):
         # what is changed is actually the "run"
         new_revision = self._revision + 1
         new_filename = re.sub(r'-(r|v)\d+.zip$', ('-v%s.zip' % version), self._filename)
-        shutil.copy(self._filename, new_filename)
         new_directory = re.sub(r'-(r|v)\d+$', ('-v%s' % version), self._directory)
-        shutil.copytree(self._directory, new_directory)
-        return ArticleZip(self._id, new_filename, new_directory, new_revision, version, self._figure_names, self._has_pdf)
+        return self._derive(new_filename, new_directory, new_revision, version)
+
+    def _derive(self, new_filename, new_directory, new_revision, new_version):
+        """The zip of the new ArticleZip is a hard link to the one of this one.
+
+        Zips are never modified in place, but replaced, so each ArticleZip only gets its own copy when it diverges.
+        The new ArticleZip extracts its own directory only if it is asked for it"""
+        _link_or_copy(self._filename, new_filename)
+        PAYLOADS.share(path.basename(self._filename), path.basename(new_filename))
+        return ArticleZip(self._id, new_filename, new_directory, new_revision, new_version, self._figure_names, self._has_pdf)
+
+    def directory(self):
+        "Creates the directory with the files of the zip, for callers that need them on disk"
+        if not path.exists(self._directory):
+            with zipfile.ZipFile(self._filename) as zip_file:
+                zip_file.extractall(self._directory)
+            LOGGER.info("Extracted %s into %s", self._filename, self._directory, extra={'id': self._id})
+        return self._directory
 
     def replace_in_text(self, replacements):
-        """Beware: violates immutability, as it modifies the file in place for performance reasons"""
+        """Beware: violates immutability, as it modifies the file in place for performance reasons.
+
+        Only the XML files are rewritten, all other entries are copied without being recompressed"""
         LOGGER.info("Replacing %s in article", replacements, extra={'id': self._id})
-        with zipfile.ZipFile(self._filename, 'w') as zip_file:
-            for file in glob.glob(self._directory + "/*"):
-                if file.endswith('.xml'):
-                    with open(file) as xml:
-                        contents = xml.read()
-                    for search, replace in replacements.iteritems():
-                        contents = contents.replace(search, replace)
-                    with open(file, 'w') as xml:
-                        xml.write(contents)
-                zip_file.write(file, path.basename(file))
+        if not replacements:
+            return self
+        # all search terms replaced in a single pass, preferring the longest when they overlap
+        pattern = re.compile('|'.join(re.escape(search) for search in sorted(replacements, key=len, reverse=True)))
+        temporary_filename = self._filename + '.tmp'
+        with zipfile.ZipFile(self._filename, 'r') as source:
+            with zipfile.ZipFile(temporary_filename, 'w') as target:
+                for info in source.infolist():
+                    if info.filename.endswith('.xml'):
+                        contents = source.read(info)
+                        modified_contents = pattern.sub(lambda match: replacements[match.group(0)], contents)
+                        if modified_contents != contents:
+                            target.writestr(_new_zip_info(info), modified_contents)
+                            self._update_extracted(info.filename, modified_contents)
+                            continue
+                    _copy_zip_entry(source, target, info)
+        os.rename(temporary_filename, self._filename)
         return self
 
+    def _update_extracted(self, name, contents):
+        if path.exists(self._directory):
+            with open(path.join(self._directory, name), 'w') as extracted_file:
+                extracted_file.write(contents)
+
     def clean(self):
+        PAYLOADS.release(path.basename(self._filename))
         if os.path.exists(self._filename):
             os.remove(self._filename)
             LOGGER.info("Deleted file %s", self._filename)
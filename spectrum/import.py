@@ -1,47 +1,100 @@
-import glob
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 import os
 import re
-import subprocess
 import sys
 import zipfile
 
+from lxml import etree
+
+MANIFEST_FILENAME = './spectrum/templates/import-manifest.json'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+def from_zips(filenames):
+    """Imports each zip in parallel, unless it has already been imported with the same contents.
+
+    Returns a dict of filenames to whether they have been imported or skipped"""
+    manifest = _load_manifest()
+    checksums = dict((filename, _checksum(filename)) for filename in filenames)
+    results = {}
+    to_import = []
+    for filename in filenames:
+        (article_full_name, _) = os.path.splitext(os.path.basename(filename))
+        target_directory = os.path.realpath('./spectrum/templates/%s' % article_full_name)
+        if manifest.get(article_full_name) == checksums[filename] and os.path.exists(target_directory):
+            results[filename] = 'skipped'
+        else:
+            to_import.append(filename)
+    with ProcessPoolExecutor() as executor:
+        for filename, _ in zip(to_import, executor.map(from_zip, to_import)):
+            (article_full_name, _) = os.path.splitext(os.path.basename(filename))
+            manifest[article_full_name] = checksums[filename]
+            results[filename] = 'imported'
+    _save_manifest(manifest)
+    return results
+
 def from_zip(filename):
     zip = zipfile.ZipFile(filename, "r")
     (article_full_name, _) = os.path.splitext(os.path.basename(filename))
     target_directory = os.path.realpath('./spectrum/templates/%s' % article_full_name)
     if not os.path.exists(target_directory):
         os.mkdir(target_directory)
-    for each in zip.namelist():
-        zip.extract(each, target_directory)
-    xml_files = glob.glob('%s/elife-[0-9][0-9][0-9][0-9][0-9].xml' % target_directory)
-    assert len(xml_files) > 0, 'No XML files correctly named found in the article package: %s' % target_directory
+    xml_files = [each for each in zip.namelist() if re.match(r'^elife-[0-9]{5}\.xml$', each)]
+    assert len(xml_files) > 0, 'No XML files correctly named found in the article package: %s' % filename
     assert len(xml_files) == 1, 'Too many XML files are named like an article in the package: %s' % xml_files
-    xml_of_article_file = xml_files[0]
-    xml_of_article_template_file = xml_of_article_file + '.jinja'
-    with open(xml_of_article_template_file, 'w') as template:
-        subprocess.call(['xmllint', '--format', xml_of_article_file], stdout=template)
-    os.remove(xml_of_article_file)
+    for each in zip.namelist():
+        if each not in xml_files:
+            zip.extract(each, target_directory)
     match = re.match(r"elife-([0-9]+)-.*-.*", article_full_name)
     assert match is not None, \
             "Could not match an id inside the article full name %s" % article_full_name
     assert len(match.groups()) == 1
     article_id = match.groups()[0]
-    search_and_replace(xml_of_article_template_file, article_id, "{{ article['id'] }}")
+    xml_of_article_template_file = '%s/%s.jinja' % (target_directory, xml_files[0])
+    with zip.open(xml_files[0]) as xml_of_article:
+        template = _pretty_print(xml_of_article).replace(article_id, "{{ article['id'] }}")
+    with open(xml_of_article_template_file, 'w') as template_file:
+        template_file.write(template)
+
+def from_xml(article_id, filename):
+    "Replaces the XML template of a kitchen sink with filename, e.g. downloaded from Github"
+    with open(filename) as xml_of_article:
+        template = _pretty_print(xml_of_article).replace(article_id, "{{ article['id'] }}")
+    with open('./spectrum/templates/elife-%s-vor-r1/elife-%s.xml.jinja' % (article_id, article_id), 'w') as template_file:
+        template_file.write(template)
 
+def _pretty_print(xml_file):
+    "Equivalent to xmllint --format, without a separate process"
+    parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+    tree = etree.parse(xml_file, parser)
+    return XML_DECLARATION + etree.tostring(tree, encoding='UTF-8', pretty_print=True)
 
-def search_and_replace(filename, search, replace):
-    contents = ''
-    with open(filename, 'r') as file:
-        contents = file.read()
+def _checksum(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as zip_file:
+        for chunk in iter(lambda: zip_file.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
-    contents = contents.replace(search, replace)
+def _load_manifest():
+    if not os.path.exists(MANIFEST_FILENAME):
+        return {}
+    with open(MANIFEST_FILENAME) as manifest_file:
+        return json.load(manifest_file)
 
-    with open(filename, 'w') as file:
-        file.write(contents)
+def _save_manifest(manifest):
+    with open(MANIFEST_FILENAME, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True, separators=(',', ': '))
+        manifest_file.write('\n')
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['--xml'] and len(sys.argv) == 4:
+        from_xml(sys.argv[2], sys.argv[3])
+        exit(0)
     if len(sys.argv) < 2:
-        print "Usage: %s ZIP_FILENAME\n" % sys.argv[0]
+        print "Usage: %s ZIP_FILENAME...\n       %s --xml ID XML_FILENAME\n" % (sys.argv[0], sys.argv[0])
         exit(1)
-    from_zip(sys.argv[1])
+    for filename, result in sorted(from_zips(sys.argv[1:]).items()):
+        print "%s: %s" % (filename, result)
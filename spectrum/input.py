@@ -1,23 +1,76 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import cookielib
+import fcntl
+import hashlib
+import json
+import os
 from os import path
 import random
+import re
 import string
-import requests
-from spectrum import aws, logger
+import threading
+import time
+from spectrum import aws, lazy, logger, sessions
 from spectrum.config import SETTINGS
-from econtools import econ_article_feeder
-from pollute import modified_environ
 import mechanicalsoup
 
 LOGGER = logger.logger(__name__)
+# how many files upload_all sends at the same time
+UPLOAD_CONCURRENCY = 10
+# files bigger than a chunk are split into parts, uploaded in parallel
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_PART_CONCURRENCY = 4
+# how many article versions to queue for publication with a single request
+PUBLISH_CHUNK_SIZE = 50
+# messages per second sent to the workflow starter queue
+SILENT_CORRECTION_RATE = 10
+# how many files are described at the same time before sending their messages
+SILENT_CORRECTION_CONCURRENCY = 10
+# the maximum number of entries of an SQS batch
+SQS_BATCH_SIZE = 10
+# where logged in Journal CMS sessions are shared between processes
+JOURNAL_CMS_SESSIONS_DIRECTORY = 'build'
+# how many sessions create content at the same time in bulk operations
+JOURNAL_CMS_CONCURRENCY = 5
 
 class InputBucket:
     def __init__(self, s3, bucket_name):
         self._s3 = s3
         self._bucket_name = bucket_name
 
-    def upload(self, filename, id):
-        self._s3.meta.client.upload_file(filename, self._bucket_name, path.basename(filename))
-        LOGGER.info("Uploaded %s to %s", filename, self._bucket_name, extra={'id': id})
+    def upload(self, filename, id, transfer_config=None):
+        "Returns the speed of the upload in bytes per second"
+        if transfer_config is None:
+            transfer_config = _transfer_config(UPLOAD_CHUNK_SIZE, UPLOAD_PART_CONCURRENCY)
+        size = os.stat(filename).st_size
+        start = time.time()
+        self._s3.meta.client.upload_file(filename, self._bucket_name, path.basename(filename), Config=transfer_config)
+        speed = size / max(time.time() - start, 0.001)
+        LOGGER.info("Uploaded %s to %s: %d bytes at %.0f bytes/s", filename, self._bucket_name, size, speed, extra={'id': id})
+        return speed
+
+    def upload_all(self, articles, concurrency=UPLOAD_CONCURRENCY, chunk_size=UPLOAD_CHUNK_SIZE, part_concurrency=UPLOAD_PART_CONCURRENCY):
+        """Uploads the zips of many ArticleZip at the same time, so that their ingestion starts together.
+
+        Returns the speed of each upload in bytes per second, in the same order"""
+        transfer_config = _transfer_config(chunk_size, part_concurrency)
+        size = sum(os.stat(article.filename()).st_size for article in articles)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.upload, article.filename(), article.id(), transfer_config) for article in articles]
+            speeds = [future.result() for future in futures]
+        elapsed = time.time() - start
+        LOGGER.info(
+            "Uploaded %d articles to %s in %.2f seconds: %d bytes at %.0f bytes/s",
+            len(articles),
+            self._bucket_name,
+            elapsed,
+            size,
+            size / max(elapsed, 0.001)
+        )
+        return speeds
 
     def name(self):
         return self._bucket_name
@@ -29,68 +82,232 @@ class Dashboard:
         self._password = password
 
     def publish(self, id, version, run):
+        (result, ) = self.publish_all([{'id': id, 'version': version, 'run': run}])
+        assert result['queued'], ("Response status was %s: %s" % (result['status_code'], result['error']))
+
+    def publish_all(self, articles, chunk_size=PUBLISH_CHUNK_SIZE):
+        """Queues the publication of many {'id': ..., 'version': ..., 'run': ...}, with a single request for each chunk.
+
+        Returns a result for each of them, in the same order: the same dict with status_code, queued and error added"""
         template = "%s/api/queue_article_publication"
         url = template % self._host
-        body = {}
-        body = {'articles': [{'id': id, 'version': version, 'run': run}]}
-        response = requests.post(url, auth=(self._user, self._password), json=body, verify=False)
-        assert response.status_code == 200, ("Response status was %s: %s" % (response.status_code, response.text))
-        LOGGER.info(
-            "Pressed Publish for %s version %s run %s on dashboard",
-            url,
-            version,
-            run,
-            extra={'id': id}
-        )
+        results = []
+        for lower in range(0, len(articles), chunk_size):
+            chunk = articles[lower:lower+chunk_size]
+            body = {'articles': chunk}
+            response = sessions.post(url, auth=(self._user, self._password), json=body, verify=False)
+            for article in chunk:
+                result = dict(article)
+                result['status_code'] = response.status_code
+                result['queued'] = response.status_code == 200
+                result['error'] = None if result['queued'] else response.text
+                results.append(result)
+                if result['queued']:
+                    LOGGER.info(
+                        "Pressed Publish for %s version %s run %s on dashboard",
+                        url,
+                        article['version'],
+                        article['run'],
+                        extra={'id': article['id']}
+                    )
+                else:
+                    LOGGER.error(
+                        "Publish for %s version %s run %s failed with status %s: %s",
+                        url,
+                        article['version'],
+                        article['run'],
+                        response.status_code,
+                        response.text,
+                        extra={'id': article['id']}
+                    )
+        return results
 
 class SilentCorrectionWorkflowStarter:
-    def __init__(self, aws_access_key_id, aws_secret_access_key, region_name, input_bucket_name, queue_name, workflow_name):
-        self._aws_access_key_id = aws_access_key_id
-        self._aws_secret_access_key = aws_secret_access_key
-        self._region_name = region_name
+    def __init__(self, s3, sqs, input_bucket_name, queue_name, workflow_name):
+        self._s3 = s3
+        self._sqs = sqs
         self._input_bucket_name = input_bucket_name
         self._queue_name = queue_name
         self._workflow_name = workflow_name
+        self._queue_url = None
 
     def article(self, filename):
-        with modified_environ(added={'AWS_ACCESS_KEY_ID': self._aws_access_key_id, 'AWS_SECRET_ACCESS_KEY': self._aws_secret_access_key, 'AWS_DEFAULT_REGION': self._region_name}):
-            econ_article_feeder.feed_econ(
-                self._input_bucket_name,
-                self._queue_name,
-                rate=1,
-                prefix=filename,
-                workflow_name='SilentCorrectionsIngest'
+        self.articles([filename])
+
+    def articles(self, filenames, rate=SILENT_CORRECTION_RATE):
+        """Starts the workflow for many files of the input bucket, sending at most rate messages per second.
+
+        Messages are the same as the ones of econtools' feeder, but sent in batches"""
+        with ThreadPoolExecutor(max_workers=SILENT_CORRECTION_CONCURRENCY) as executor:
+            messages = list(executor.map(self._message, filenames))
+        queue_url = self._workflow_starter_queue_url()
+        batch_size = max(1, min(SQS_BATCH_SIZE, int(rate)))
+        start = time.time()
+        for lower in range(0, len(messages), batch_size):
+            # each batch is sent when the rate allows all the previous messages
+            delay = start + float(lower) / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            batch = messages[lower:lower+batch_size]
+            response = self._sqs.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': str(index), 'MessageBody': _message_body(message)} for (index, message) in enumerate(batch)]
             )
+            assert not response.get('Failed'), ("Some messages could not be sent to %s: %s" % (self._queue_name, response['Failed']))
+            for message in batch:
+                LOGGER.info(
+                    "Started %s for %s",
+                    self._workflow_name,
+                    message['workflow_data']['file_name']
+                )
+
+    def _message(self, filename):
+        "Describes the file as if its upload to the bucket had been notified"
+        s3_object = self._s3.meta.client.head_object(Bucket=self._input_bucket_name, Key=filename)
+        return {
+            'workflow_name': self._workflow_name,
+            'workflow_data': {
+                'event_time': s3_object['LastModified'].strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'event_name': 'ObjectCreated:Put',
+                'file_name': filename,
+                'file_etag': s3_object['ETag'].strip('"'),
+                'bucket_name': self._input_bucket_name,
+                'file_size': s3_object['ContentLength'],
+            }
+        }
+
+    def _workflow_starter_queue_url(self):
+        if self._queue_url is None:
+            self._queue_url = self._sqs.get_queue_url(QueueName=self._queue_name)['QueueUrl']
+        return self._queue_url
 
 class JournalCms:
     def __init__(self, host, user, password):
         self._host = host
         self._user = user
         self._password = password
+        # one cookie jar for each host and user, shared by all processes
+        key = hashlib.sha1("%s %s" % (host, user)).hexdigest()
+        self._cookies_filename = "%s/journal-cms-%s.cookies" % (JOURNAL_CMS_SESSIONS_DIRECTORY, key)
+        self._lock = threading.Lock()
+
+    def login(self, reuse=True):
+        """Reuses the cookies of a previous login, of this or another process, while they are still valid.
 
-    def login(self):
+        Only logs in again when the session has expired, or always with reuse=False"""
         browser = mechanicalsoup.Browser()
+        with self._locked_cookies():
+            cookies = self._load_cookies() if reuse else []
+            browser.session.cookies.update(cookies)
+            if len(cookies) > 0 and self._is_logged_in(browser):
+                LOGGER.info("Reusing session of %s on %s", self._user, self._host)
+            else:
+                browser.session.cookies.clear()
+                self._login(browser)
+                self._save_cookies(browser.session.cookies)
+        return JournalCmsSession(self._host, browser)
+
+    def create_blog_articles(self, titles, text='Lorem ipsum', image=None, concurrency=JOURNAL_CMS_CONCURRENCY):
+        """Creates many blog articles over concurrent sessions.
+
+        Returns their node ids in the same order as titles, and the latencies of each step across all sessions"""
+        return self._create_all(titles, lambda session, title: session.create_blog_article(title, text, image), concurrency)
+
+    def create_article_fragments(self, ids, image, concurrency=JOURNAL_CMS_CONCURRENCY):
+        """Like create_blog_articles, for the article fragments of many article ids.
+
+        Only returns the latencies, as fragments are identified by their article id"""
+        (_, latencies) = self._create_all(ids, lambda session, id: session.create_article_fragment(id, image), concurrency)
+        return latencies
+
+    def _create_all(self, items, create, concurrency):
+        if not items:
+            return ([], {})
+        cms_sessions = [self.login() for _ in range(min(concurrency, len(items)))]
+        results = [None] * len(items)
+        def create_with(session_index):
+            # each session is used by a single thread, and creates every nth item
+            for item_index in range(session_index, len(items), len(cms_sessions)):
+                results[item_index] = create(cms_sessions[session_index], items[item_index])
+        with ThreadPoolExecutor(max_workers=len(cms_sessions)) as executor:
+            futures = [executor.submit(create_with, session_index) for session_index in range(len(cms_sessions))]
+            for future in futures:
+                future.result()
+        latencies = {}
+        for cms_session in cms_sessions:
+            for step, seconds in cms_session.latencies().items():
+                latencies.setdefault(step, []).extend(seconds)
+        for step, seconds in sorted(latencies.items()):
+            LOGGER.info(
+                "Journal CMS step %s: %d times, %.2f seconds on average, %.2f at most",
+                step,
+                len(seconds),
+                sum(seconds) / len(seconds),
+                max(seconds)
+            )
+        return (results, latencies)
+
+    def _login(self, browser):
         login_url = "%s/user/login" % self._host
         login_page = browser.get(login_url)
         form = mechanicalsoup.Form(login_page.soup.form)
         form.input({'name': self._user, 'pass': self._password})
         response = browser.submit(form, login_page.url)
         assert _journal_cms_page_title(response.soup) == self._user
-        return JournalCmsSession(self._host, browser)
+        LOGGER.info("Logged in as %s on %s", self._user, self._host)
+
+    def _is_logged_in(self, browser):
+        "Anonymous users are redirected to the login form, authenticated ones to their profile"
+        response = browser.session.get("%s/user" % self._host, allow_redirects=False)
+        return response.status_code < 400 and '/user/login' not in response.headers.get('Location', '')
+
+    @contextmanager
+    def _locked_cookies(self):
+        "Only one thread of one process at a time checks the session, and logs in if needed"
+        with self._lock:
+            with open(self._cookies_filename + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_cookies(self):
+        cookies = cookielib.LWPCookieJar(self._cookies_filename)
+        if path.exists(self._cookies_filename):
+            # Drupal session cookies have no expiry date
+            cookies.load(ignore_discard=True)
+        return cookies
+
+    def _save_cookies(self, session_cookies):
+        cookies = cookielib.LWPCookieJar(self._cookies_filename + '.tmp')
+        for cookie in session_cookies:
+            cookies.set_cookie(cookie)
+        cookies.save(ignore_discard=True)
+        os.rename(self._cookies_filename + '.tmp', self._cookies_filename)
 
 class JournalCmsSession:
     def __init__(self, host, browser):
         self._host = host
         self._browser = browser
+        # step name => list of seconds
+        self._latencies = {}
+
+    def latencies(self):
+        "How long each step of content creation took, e.g. {'form': [0.3, 0.4], 'save': [1.2, 0.9]}"
+        return self._latencies
 
     def create_blog_article(self, title, text='Lorem ipsum', image=None):
+        "Returns the node id of the new blog article"
         create_url = "%s/node/add/blog_article" % self._host
-        create_page = self._browser.get(create_url)
+        with self._timed('form'):
+            create_page = self._browser.get(create_url)
         form = mechanicalsoup.Form(create_page.soup.form)
         form.input({'title[0][value]': title})
         LOGGER.info("Adding paragraph")
         self._choose_submit(form, 'field_content_paragraph_add_more')
-        response = self._browser.submit(form, create_page.url)
+        with self._timed('paragraph'):
+            response = self._browser.submit(form, create_page.url)
         form = mechanicalsoup.Form(response.soup.form)
         form.textarea({'field_content[0][subform][field_block_html][0][value]': text})
         if image:
@@ -101,15 +318,18 @@ class JournalCmsSession:
         LOGGER.info("Saving form")
         self._choose_submit(form, 'op', value='Save and publish')
         # not sure why, but `data` here is necessary
-        response = self._browser.submit(form, create_page.url, data={'op': 'Save and publish'})
+        with self._timed('save'):
+            response = self._browser.submit(form, create_page.url, data={'op': 'Save and publish'})
         assert _journal_cms_page_title(response.soup) == title
-        #check https://end2end--journal-cms.elifesciences.org/admin/content?status=All&type=All&title=b9djvu04y6v1t4kug4ts8kct5pagf8&langcode=All
-        # but in checks module
-        # TODO: return id and/or node id
+        # the page of the new node may be at a path alias, but its title says which node it is
+        node_id = _journal_cms_node_id(response.soup)
+        LOGGER.info("Created blog article %s: %s", node_id, title)
+        return node_id
 
     def create_article_fragment(self, id, image):
         create_url = "%s/admin/structure/article_fragment/add" % self._host
-        create_page = self._browser.get(create_url)
+        with self._timed('form'):
+            create_page = self._browser.get(create_url)
         form = mechanicalsoup.Form(create_page.soup.form)
         form.input({'name[0][value]': id})
         form.attach({'files[image_0]': image})
@@ -119,7 +339,8 @@ class JournalCmsSession:
             extra={'id': id}
         )
         self._choose_submit(form, 'image_0_upload_button', value='Upload')
-        response = self._browser.submit(form, create_page.url)
+        with self._timed('image'):
+            response = self._browser.submit(form, create_page.url)
         form = mechanicalsoup.Form(response.soup.form)
 
 
@@ -131,13 +352,15 @@ class JournalCmsSession:
             extra={'id': id}
         )
         self._choose_submit(form, 'banner_image_0_upload_button', value='Upload')
-        response = self._browser.submit(form, create_page.url)
+        with self._timed('image'):
+            response = self._browser.submit(form, create_page.url)
         form = mechanicalsoup.Form(response.soup.form)
         LOGGER.info(
             "Saving form",
             extra={'id': id}
         )
-        response = self._browser.submit(form, create_page.url, data={'op': 'Save'})
+        with self._timed('save'):
+            response = self._browser.submit(form, create_page.url, data={'op': 'Save'})
         img = response.soup.select_one(".field--name-banner-image img")
         assert "king_county" in img.get('src')
         LOGGER.info(
@@ -146,6 +369,12 @@ class JournalCmsSession:
             extra={'id': id}
         )
 
+    @contextmanager
+    def _timed(self, step):
+        start = time.time()
+        yield
+        self._latencies.setdefault(step, []).append(time.time() - start)
+
     def _choose_submit(self, wrapped_form, name, value=None):
         """Fixed version of mechanicalsoup.Form.choose_submit()
 
@@ -165,6 +394,23 @@ class JournalCmsSession:
                 continue
             del inp['name']
 
+def _transfer_config(chunk_size, part_concurrency):
+    # boto3 is only imported by processes that use it, see aws
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size, max_concurrency=part_concurrency)
+
+def _message_body(message):
+    "The workflow starter reads messages written by boto 2, which base64-encodes their bodies"
+    return base64.b64encode(json.dumps(message))
+
+def _journal_cms_node_id(soup):
+    "See _journal_cms_page_title for the markup"
+    field = soup.find("h1", {"class": "page-title"}).find(attrs={"data-quickedit-field-id": True})
+    assert field is not None, "Cannot find the node id in the page title: %s" % soup.find("h1", {"class": "page-title"})
+    match = re.match(r'^node/(\d+)/', field['data-quickedit-field-id'])
+    assert match is not None, "Cannot find the node id in %s" % field['data-quickedit-field-id']
+    return match.group(1)
+
 def _journal_cms_page_title(soup):
     # <h1 class="js-quickedit-page-title title page-title"><span data-quickedit-field-id="node/1709/title/en/full" class="field field--name-title field--type-string field--label-hidden">Spectrum blog article: jvsfz4oj9vz9hk239fbpq4fbjc9yoh</span></h1>
     #<h1 class="js-quickedit-page-title title page-title">alfred</h1>
@@ -174,25 +420,24 @@ def _journal_cms_page_title(soup):
 def invented_word():
     return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(30))
 
-PRODUCTION_BUCKET = InputBucket(aws.S3, SETTINGS['bucket_input'])
-SILENT_CORRECTION_BUCKET = InputBucket(aws.S3, SETTINGS['bucket_silent_corrections'])
-DASHBOARD = Dashboard(
+PRODUCTION_BUCKET = lazy.Lazy(lambda: InputBucket(aws.S3, SETTINGS['bucket_input']))
+SILENT_CORRECTION_BUCKET = lazy.Lazy(lambda: InputBucket(aws.S3, SETTINGS['bucket_silent_corrections']))
+DASHBOARD = lazy.Lazy(lambda: Dashboard(
     SETTINGS['dashboard_host'],
     SETTINGS['dashboard_user'],
     SETTINGS['dashboard_password']
-)
+))
 
-SILENT_CORRECTION = SilentCorrectionWorkflowStarter(
-    SETTINGS['aws_access_key_id'],
-    SETTINGS['aws_secret_access_key'],
-    SETTINGS['region_name'],
+SILENT_CORRECTION = lazy.Lazy(lambda: SilentCorrectionWorkflowStarter(
+    aws.S3,
+    aws.SQS,
     SILENT_CORRECTION_BUCKET.name(),
     SETTINGS['queue_workflow_starter'],
     'SilentCorrectionsIngest'
-)
+))
 
-JOURNAL_CMS = JournalCms(
+JOURNAL_CMS = lazy.Lazy(lambda: JournalCms(
     SETTINGS['journal_cms_host'],
     SETTINGS['journal_cms_user'],
     SETTINGS['journal_cms_password']
-)
+))
@@ -0,0 +1,24 @@
+"Objects built at their first use rather than at import, so that each process only pays for what it uses"
+import threading
+
+class Lazy:
+    """Stands for the object returned by factory, calling it once on the first attribute access.
+
+    Safe to share between threads: concurrent first accesses wait for the same instance"""
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance = None
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def initialized(self):
+        return self._instance is not None
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
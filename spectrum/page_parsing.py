@@ -0,0 +1,44 @@
+"""How long checks take to analyze journal pages, parsing each of them once with lxml rather than once per extractor with html.parser.
+
+Pages are fetched through JournalCheck, or read from files where they have been saved before:
+python -m spectrum.page_parsing [PATH_OR_FILE...]"""
+from os import path
+import sys
+import timeit
+
+from spectrum import checks, pages
+
+# kitchen sink articles can be added as /content/VOLUME/eID
+PATHS = ['/', '/magazine', '/search?for=cytomegalovirus']
+OLD_PARSER = 'html.parser'
+
+def one_parse_per_extractor(html_content):
+    "How JournalCheck used to analyze a page: resources, links and counts each parsed the page again"
+    pages.Page(html_content, parser=OLD_PARSER).resources()
+    pages.Page(html_content, parser=OLD_PARSER).link('view-selector__link--figures')
+    pages.Page(html_content, parser=OLD_PARSER).count('teaser')
+
+def single_parse(html_content):
+    page = pages.Page(html_content)
+    page.resources()
+    page.link('view-selector__link--figures')
+    page.count('teaser')
+
+def measure(html_content, repetitions=5):
+    "Returns the fastest timings of the old and new analysis"
+    before = min(timeit.repeat(lambda: one_parse_per_extractor(html_content), number=1, repeat=repetitions))
+    after = min(timeit.repeat(lambda: single_parse(html_content), number=1, repeat=repetitions))
+    return (before, after)
+
+def _content(path_or_file):
+    if path.isfile(path_or_file):
+        with open(path_or_file) as html_file:
+            return html_file.read()
+    return checks.JOURNAL.generic(path_or_file)
+
+if __name__ == '__main__':
+    print "%-50s %10s %12s %12s %8s" % ("page", "size", "before (s)", "after (s)", "speedup")
+    for each in sys.argv[1:] if len(sys.argv) > 1 else PATHS:
+        content = _content(each)
+        (before, after) = measure(content)
+        print "%-50s %10d %12.4f %12.4f %7.1fx" % (each, len(content), before, after, before / after)
@@ -0,0 +1,60 @@
+"HTML pages parsed once, with all the information checks need extracted from the same tree"
+from bs4 import BeautifulSoup
+
+# C-backed, much faster than the pure Python html.parser
+PARSER = 'lxml'
+
+class Page:
+    def __init__(self, html_content, parser=PARSER):
+        self._soup = BeautifulSoup(html_content, parser)
+
+    def soup(self):
+        return self._soup
+
+    def resources(self):
+        "Paths or urls of <img>, <script>, <link>, <video>, <source> and srcset, possibly None"
+        return _resources_from(self._soup)
+
+    def link(self, class_name):
+        """Finds out where the link selected with CSS class_name points to.
+
+        May return None if there is no actual link with this class on the page"""
+        links = self._soup.find_all("a", class_=class_name)
+        assert len(links) <= 1, \
+               ("Found too many links for the class name %s: %s" % (class_name, links))
+        return links[0]['href'] if len(links) == 1 else None
+
+    def count(self, class_):
+        "How many elements of any type have this class"
+        return len(self._soup.find_all(True, class_=class_))
+
+    def teaser_links(self):
+        teaser_a_tags = self._soup.select("div.teaser .teaser__header_text_link")
+        return [a['href'] for a in teaser_a_tags]
+
+def _srcset_values(srcset):
+    values = []
+    for candidate_string in [s.strip() for s in srcset.split(",")]:
+        url_and_maybe_descriptors = candidate_string.split(" ")
+        values.append(url_and_maybe_descriptors[0])
+        return values
+
+def _resources_from(soup):
+    resources = []
+    for img in soup.find_all("img"):
+        resources.append(img.get("src"))
+        srcset = img.get("srcset")
+        if srcset:
+            resources.extend(_srcset_values(srcset))
+    for script in soup.find_all("script"):
+        if script.get("src"):
+            resources.append(script.get("src"))
+    for link in soup.find_all("link"):
+        resources.append(link.get("href"))
+    for video in soup.find_all("video"):
+        resources.append(video.get("poster"))
+    for media_source in soup.find_all("source"):
+        srcset = media_source.get("srcset")
+        if srcset:
+            resources.extend(_srcset_values(srcset))
+    return resources
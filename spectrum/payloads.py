@@ -0,0 +1,144 @@
+"Content-addressed store of the binary files of templates, shared by all the articles generated from them"
+import errno
+import glob
+import hashlib
+import os
+from os import path
+import shutil
+import threading
+import time
+import zipfile
+import zlib
+
+from spectrum import logger
+
+LOGGER = logger.logger(__name__)
+CHUNK_SIZE = 1024 * 1024
+
+class PayloadStore:
+    """Each distinct content is stored once, under its digest, and written from there straight into article zips.
+
+    Every article using a content has a hard link to it in the references directory:
+    the number of links of a stored file is its reference count, and it is evicted when only the store references it"""
+    def __init__(self, directory):
+        self._directory = directory
+        self._references_directory = path.join(directory, 'references')
+        # (filename, size, mtime) => (digest, CRC-32)
+        self._descriptions = {}
+        self._lock = threading.Lock()
+
+    def write(self, zip_file, filename, name, owner):
+        """Adds the content of filename to zip_file as name, referenced by owner until release(owner).
+
+        The entry is stored with the CRC computed when the content was first seen, without reading it twice"""
+        stat = os.stat(filename)
+        (digest, crc) = self._describe(filename, stat)
+        reference = self._reference(filename, digest, owner)
+        info = zipfile.ZipInfo(name, time.localtime(stat.st_mtime)[0:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = (stat.st_mode & 0xFFFF) << 16
+        info.file_size = info.compress_size = stat.st_size
+        info.CRC = crc
+        info.header_offset = zip_file.fp.tell()
+        zip_file.fp.write(info.FileHeader())
+        # the reference keeps the content alive even if another process evicts it from the store
+        with open(reference, 'rb') as payload:
+            shutil.copyfileobj(payload, zip_file.fp, CHUNK_SIZE)
+        zip_file.filelist.append(info)
+        zip_file.NameToInfo[name] = info
+
+    def share(self, owner, new_owner):
+        "new_owner references the same contents as owner, e.g. a new revision of the same article"
+        for reference in self._references_of(owner):
+            digest = path.basename(reference)[len(owner) + 1:]
+            try:
+                os.link(reference, self._reference_filename(new_owner, digest))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def references(self, digest):
+        try:
+            return os.stat(self._stored(digest)).st_nlink - 1
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+
+    def release(self, owner):
+        "Drops the references of owner, evicting the contents nothing references anymore"
+        for reference in self._references_of(owner):
+            digest = path.basename(reference)[len(owner) + 1:]
+            os.remove(reference)
+            stored = self._stored(digest)
+            try:
+                if os.stat(stored).st_nlink == 1:
+                    os.remove(stored)
+                    LOGGER.debug("Evicted %s", digest)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def clean(self):
+        "Existing references stay valid, as their links keep the content alive"
+        if path.exists(self._directory):
+            shutil.rmtree(self._directory)
+            LOGGER.info("Deleted directory %s", self._directory)
+
+    def _describe(self, filename, stat):
+        "Memoized until the file changes"
+        key = (filename, stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key not in self._descriptions:
+                self._descriptions[key] = _sha1_and_crc(filename)
+            return self._descriptions[key]
+
+    def _reference(self, filename, digest, owner):
+        reference = self._reference_filename(owner, digest)
+        _makedirs(self._references_directory)
+        while True:
+            if not path.exists(self._stored(digest)):
+                self._add(filename, digest)
+            try:
+                os.link(self._stored(digest), reference)
+                return reference
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    # the same content used twice by the same owner
+                    return reference
+                if e.errno != errno.ENOENT:
+                    raise
+                # evicted by another process in the meantime
+
+    def _add(self, filename, digest):
+        stored = self._stored(digest)
+        temporary = "%s.%s.%s.tmp" % (stored, os.getpid(), threading.current_thread().ident)
+        shutil.copy(filename, temporary)
+        # another process may be doing the same, but either copy is fine
+        os.rename(temporary, stored)
+        LOGGER.debug("Stored %s as %s", filename, digest)
+
+    def _references_of(self, owner):
+        return glob.glob(self._reference_filename(owner, '*'))
+
+    def _reference_filename(self, owner, digest):
+        return path.join(self._references_directory, '%s.%s' % (owner, digest))
+
+    def _stored(self, digest):
+        return path.join(self._directory, digest)
+
+def _sha1_and_crc(filename):
+    sha1 = hashlib.sha1()
+    crc = 0
+    with open(filename, 'rb') as payload:
+        for chunk in iter(lambda: payload.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return (sha1.hexdigest(), crc & 0xffffffff)
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,87 @@
+"Runs a graph of checks concurrently, each one starting as soon as its dependencies have succeeded"
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import time
+
+from spectrum import logger, scheduling
+
+LOGGER = logger.logger(__name__)
+
+class CheckGraph:
+    def __init__(self, id=None):
+        self._id = id
+        self._checks = OrderedDict()
+
+    def add(self, name, check_fn, depends_on=None):
+        """Declares a check.
+
+        check_fn is called with the results of its dependencies as keyword arguments, named after them"""
+        depends_on = depends_on if depends_on else []
+        assert name not in self._checks, "Check %s has already been declared" % name
+        for dependency in depends_on:
+            assert dependency in self._checks, \
+                "Check %s depends on %s, which has not been declared before it" % (name, dependency)
+        self._checks[name] = (check_fn, depends_on)
+        return self
+
+    def run(self):
+        """Runs all checks and returns a dictionary of their results.
+
+        Raises the error of the first check to fail, after the others have given up"""
+        cancellation = scheduling.Cancellation()
+        results = {}
+        durations = {}
+        started = {}
+        running = {}
+        not_started = list(self._checks.keys())
+        executor = ThreadPoolExecutor(max_workers=max(len(self._checks), 1))
+        pipeline_start = time.time()
+        try:
+            while not_started or running:
+                for name in list(not_started):
+                    (check_fn, depends_on) = self._checks[name]
+                    if all(dependency in results for dependency in depends_on):
+                        arguments = dict((dependency, results[dependency]) for dependency in depends_on)
+                        started[name] = time.time()
+                        running[executor.submit(self._run_check, cancellation, check_fn, arguments)] = name
+                        not_started.remove(name)
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    durations[name] = time.time() - started[name]
+                    if future.exception() is not None:
+                        LOGGER.error(
+                            "Check %s failed after %.1fs; still running: %s; not started: %s; completed: %s",
+                            name,
+                            durations[name],
+                            sorted(running.values()),
+                            not_started,
+                            self._format(durations),
+                            extra={'id': self._id}
+                        )
+                        # wakes up the checks still polling, so that they give up
+                        cancellation.cancel("Check %s failed: %s" % (name, future.exception()))
+                        for other in running:
+                            other.cancel()
+                    # re-raises the failure, if any
+                    results[name] = future.result()
+        finally:
+            cancellation.cancel("Pipeline of checks interrupted")
+            executor.shutdown(wait=True)
+        LOGGER.info(
+            "Completed %d checks in %.1fs: %s",
+            len(results),
+            time.time() - pipeline_start,
+            self._format(durations),
+            extra={'id': self._id}
+        )
+        return results
+
+    def _run_check(self, cancellation, check_fn, arguments):
+        with scheduling.cancellable(cancellation):
+            return check_fn(**arguments)
+
+    def _format(self, durations):
+        "Slowest checks first"
+        ordered = sorted(durations.items(), key=lambda item: item[1], reverse=True)
+        return ", ".join("%s=%.1fs" % (name, duration) for (name, duration) in ordered)
@@ -0,0 +1,190 @@
+"Decides when polling should happen again, and until when"
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+
+from spectrum import logger
+
+LOGGER = logger.logger(__name__)
+
+class ConstantBackoff:
+    def __init__(self, step):
+        self._step = step
+
+    def delays(self):
+        while True:
+            yield self._step
+
+    def maximum(self):
+        return self._step
+
+class ExponentialBackoff:
+    "Starts polling quickly, then slows down up to a maximum delay; jitter spreads out checks started together"
+    def __init__(self, initial=0.5, factor=1.5, maximum=5, jitter=0.1):
+        self._initial = initial
+        self._factor = factor
+        self._maximum = maximum
+        self._jitter = jitter
+
+    def delays(self):
+        delay = self._initial
+        while True:
+            yield delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+            delay = min(delay * self._factor, self._maximum)
+
+    def maximum(self):
+        return self._maximum * (1 + self._jitter)
+
+class Deadline:
+    def __init__(self, seconds):
+        self._seconds = seconds
+        self._expires_at = time.time() + seconds
+
+    def seconds(self):
+        return self._seconds
+
+    def remaining(self):
+        return max(self._expires_at - time.time(), 0)
+
+class Cancellation:
+    "Happens at most once, with a reason, to make the polling depending on it give up"
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reason = None
+        self._cancelled = False
+        self._listeners = []
+
+    def cancel(self, reason):
+        "Only the first reason is kept"
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            self._reason = reason
+            listeners = list(self._listeners)
+        for event in listeners:
+            event.set()
+
+    def cancelled(self):
+        return self._cancelled
+
+    def reason(self):
+        return self._reason
+
+    def listen(self, event):
+        "event is set when the cancellation happens, or immediately if it already happened"
+        with self._lock:
+            self._listeners.append(event)
+            if self._cancelled:
+                event.set()
+
+    def unlisten(self, event):
+        with self._lock:
+            self._listeners.remove(event)
+
+_CURRENT = threading.local()
+
+@contextmanager
+def cancellable(cancellation):
+    "Makes cancellation apply to all the polling done by the current thread inside this block"
+    previous = current_cancellation()
+    _CURRENT.cancellation = cancellation
+    try:
+        yield cancellation
+    finally:
+        _CURRENT.cancellation = previous
+
+def current_cancellation():
+    return getattr(_CURRENT, 'cancellation', None)
+
+def sleep(seconds, cancellations):
+    "Like time.sleep(), but wakes up as soon as one of the cancellations happens"
+    if not cancellations:
+        time.sleep(seconds)
+        return
+    woken = threading.Event()
+    for cancellation in cancellations:
+        cancellation.listen(woken)
+    try:
+        woken.wait(seconds)
+    finally:
+        for cancellation in cancellations:
+            cancellation.unlisten(woken)
+
+class LatencyHints:
+    """How long each kind of check took in previous runs, shared through a file.
+
+    Stores a moving average so that a single outlier does not dominate.
+    Measurements stay in memory until save() merges them into the file, once per process"""
+    def __init__(self, filename, weight=0.3):
+        self._filename = filename
+        self._weight = weight
+        self._lock = threading.Lock()
+        self._hints = None
+        self._measurements = []
+
+    def expected(self, name):
+        with self._lock:
+            return self._loaded().get(name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            hints = self._loaded()
+            hints[name] = self._average(hints.get(name), seconds)
+            self._measurements.append((name, seconds))
+
+    def save(self):
+        "Applies this process's measurements on top of what other processes have saved in the meantime"
+        with self._lock:
+            if not self._measurements:
+                return
+            with open(self._filename + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    hints = self._load()
+                    for (name, seconds) in self._measurements:
+                        hints[name] = self._average(hints.get(name), seconds)
+                    self._write(hints)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            LOGGER.info("Saved %d latency measurements to %s", len(self._measurements), self._filename)
+            self._measurements = []
+
+    def _loaded(self):
+        if self._hints is None:
+            self._hints = self._load()
+        return self._hints
+
+    def _average(self, previous, seconds):
+        if previous is None:
+            return seconds
+        return (1 - self._weight) * previous + self._weight * seconds
+
+    def _load(self):
+        if not os.path.exists(self._filename):
+            return {}
+        try:
+            with open(self._filename) as hints_file:
+                return json.load(hints_file)
+        except ValueError as e:
+            LOGGER.warning("Ignoring corrupted latency hints in %s: %s", self._filename, e)
+            return {}
+
+    def _write(self, hints):
+        temporary_filename = "%s.%s.tmp" % (self._filename, os.getpid())
+        with open(temporary_filename, 'w') as hints_file:
+            json.dump(hints, hints_file, indent=4, sort_keys=True)
+        os.rename(temporary_filename, self._filename)
+
+def next_delay(backoff_delay, elapsed, expected, maximum):
+    """Combines the delay of the backoff strategy with what we know about the check.
+
+    Until the expected latency is reached, waits half of the remaining time, so that polling converges on it.
+    Never waits more than maximum, so that a check faster than usual is not noticed too late"""
+    if expected and elapsed < expected:
+        return max(backoff_delay, min((expected - elapsed) / 2, maximum))
+    return backoff_delay
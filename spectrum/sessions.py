@@ -0,0 +1,86 @@
+"HTTP sessions shared by all checks and inputs, keeping connections to each host alive across requests"
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import cookielib, urlparse
+from requests.packages.urllib3.util.retry import Retry
+from spectrum import logger
+
+POOL_SIZE = int(os.environ['SPECTRUM_HTTP_POOL_SIZE']) if 'SPECTRUM_HTTP_POOL_SIZE' in os.environ else 20
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = int(os.environ['SPECTRUM_HTTP_TIMEOUT']) if 'SPECTRUM_HTTP_TIMEOUT' in os.environ else 60
+# idempotent requests are retried on connection problems and gateway errors,
+# e.g. a page too slow to load may be cut by a CDN timeout with a 504;
+# after the last attempt the response is returned as it is, to be inspected
+RETRY = Retry(
+    total=3,
+    status_forcelist=[502, 503, 504],
+    method_whitelist=['GET', 'HEAD'],
+    backoff_factor=0.5,
+    raise_on_status=False
+)
+LOGGER = logger.logger(__name__)
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def get(url, **kwargs):
+    return session(url).get(url, **_with_defaults(kwargs))
+
+def head(url, **kwargs):
+    return session(url).head(url, **_with_defaults(kwargs))
+
+def post(url, **kwargs):
+    return session(url).post(url, **_with_defaults(kwargs))
+
+def session(url):
+    "Returns the session dedicated to the host of url"
+    parsed = urlparse(url)
+    host = "%s://%s" % (parsed.scheme, parsed.netloc)
+    with _SESSIONS_LOCK:
+        if host not in _SESSIONS:
+            _SESSIONS[host] = _new_session()
+        return _SESSIONS[host]
+
+def statistics():
+    """Returns how many requests have been sent to each host, and how many connections had to be opened for them.
+
+    The difference between the two is the number of connections reused"""
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.items())
+    result = {}
+    for host, host_session in sessions:
+        counts = {'requests': 0, 'connections': 0}
+        for adapter in set(host_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools[pool_key]
+                counts['requests'] += pool.num_requests
+                counts['connections'] += pool.num_connections
+        result[host] = counts
+    return result
+
+def log_statistics():
+    for host, counts in sorted(statistics().items()):
+        LOGGER.info(
+            "%s: %d requests over %d connections",
+            host,
+            counts['requests'],
+            counts['connections']
+        )
+
+def _new_session():
+    new_session = requests.Session()
+    # checks must see what an anonymous user sees, e.g. through a CDN
+    new_session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=RETRY)
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+def _with_defaults(kwargs):
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return kwargs
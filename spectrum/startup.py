@@ -0,0 +1,34 @@
+"""How long importing spectrum takes, which every xdist worker pays before running any test.
+
+Run as a script to compare it against a budget, in seconds:
+python -m spectrum.startup [BUDGET]"""
+import subprocess
+import sys
+
+# what collecting the tests imports
+MODULES = ['spectrum.checks', 'spectrum.generator', 'spectrum.input', 'spectrum.synthesizer']
+BUDGET = 0.5
+MEASUREMENT = """
+import time
+start = time.time()
+import %s
+elapsed = time.time() - start
+from spectrum import aws
+assert not (aws.S3.initialized() or aws.SWF.initialized() or aws.SQS.initialized()), "AWS clients should not be built at import"
+print elapsed
+"""
+
+def measure(modules, repetitions=5):
+    "Returns the fastest of several imports, each in a new process so that nothing is already loaded"
+    timings = []
+    for _ in range(repetitions):
+        output = subprocess.check_output([sys.executable, '-c', MEASUREMENT % ', '.join(modules)])
+        timings.append(float(output.strip().split('\n')[-1]))
+    return min(timings)
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET
+    elapsed = measure(MODULES)
+    print "Imported %s in %.3f seconds, with a budget of %.3f" % (', '.join(MODULES), elapsed, budget)
+    if elapsed > budget:
+        exit(1)
@@ -0,0 +1,99 @@
+"""Downloads the latest revision of kitchen sinks from S3, only if they changed since the last sync.
+
+Prints the names of the downloaded zips, to be passed to import.sh:
+python -m spectrum.sync [--bucket BUCKET] ID...
+
+Once they have been imported, remembers them as synced and prints their keys on S3:
+python -m spectrum.sync --record"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import sys
+
+from boto3.s3.transfer import TransferConfig
+from spectrum import aws, logger
+
+LOGGER = logger.logger(__name__)
+DEFAULT_BUCKET = 'ct-elife-production-final'
+MANIFEST_FILENAME = './spectrum/templates/s3-manifest.json'
+# downloaded but not imported yet
+PENDING_FILENAME = 'build/s3-manifest.pending.json'
+CONCURRENCY = 10
+# parts of a large zip are downloaded in parallel too
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024, max_concurrency=10)
+
+def sync(ids, bucket_name=DEFAULT_BUCKET):
+    """Returns the names of the zips that have been downloaded.
+
+    They are only added to the manifest by record(), so that a failed import downloads them again next time"""
+    manifest = _load(MANIFEST_FILENAME)
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        latest = dict(zip(ids, executor.map(lambda id: _latest_revision(bucket_name, id), ids)))
+        changed = [id for id in ids if manifest.get(id) != latest[id]]
+        for id in ids:
+            if id not in changed:
+                LOGGER.info("Unchanged %s", latest[id]['key'], extra={'id': id})
+        filenames = list(executor.map(lambda id: _download(bucket_name, id, latest[id]['key']), changed))
+    _save(PENDING_FILENAME, dict((id, latest[id]) for id in changed))
+    return filenames
+
+def record():
+    "Adds the zips downloaded by the last sync() to the manifest, returning their keys"
+    pending = _load(PENDING_FILENAME)
+    manifest = _load(MANIFEST_FILENAME)
+    manifest.update(pending)
+    _save(MANIFEST_FILENAME, manifest)
+    if os.path.exists(PENDING_FILENAME):
+        os.remove(PENDING_FILENAME)
+    for id in sorted(pending):
+        LOGGER.info("Recorded %s", pending[id]['key'], extra={'id': id})
+    return [pending[id]['key'] for id in sorted(pending)]
+
+def _latest_revision(bucket_name, id):
+    "Returns a dict with the key and ETag of the zip with the highest revision number"
+    paginator = aws.S3.meta.client.get_paginator('list_objects_v2')
+    candidates = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix='elife-%s-' % id):
+        for s3_object in page.get('Contents', []):
+            match = re.match(r'^.*-r(\d+)\.zip$', s3_object['Key'])
+            if match:
+                candidates.append((int(match.group(1)), s3_object))
+    assert len(candidates) > 0, "No zip found for %s in bucket %s" % (id, bucket_name)
+    (_, s3_object) = max(candidates, key=lambda candidate: candidate[0])
+    return {'key': s3_object['Key'], 'etag': s3_object['ETag']}
+
+def _download(bucket_name, id, key):
+    canonical_filename = "elife-%s-vor-r1.zip" % id
+    temporary_filename = canonical_filename + '.tmp'
+    LOGGER.info("Downloading %s as %s", key, canonical_filename, extra={'id': id})
+    aws.S3.meta.client.download_file(bucket_name, key, temporary_filename, Config=TRANSFER_CONFIG)
+    os.rename(temporary_filename, canonical_filename)
+    return canonical_filename
+
+def _load(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as manifest_file:
+        return json.load(manifest_file)
+
+def _save(filename, manifest):
+    with open(filename, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True, separators=(',', ': '))
+        manifest_file.write('\n')
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    if arguments == ['--record']:
+        for key in record():
+            print key
+        exit(0)
+    bucket = DEFAULT_BUCKET
+    if arguments[:1] == ['--bucket']:
+        bucket = arguments[1]
+        arguments = arguments[2:]
+    if len(arguments) < 1:
+        print "Usage: %s [--bucket BUCKET] ID...\n       %s --record\n" % (sys.argv[0], sys.argv[0])
+        exit(1)
+    for filename in sync(arguments, bucket):
+        print filename
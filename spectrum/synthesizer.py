@@ -0,0 +1,106 @@
+"""Articles of any size, generated from a base template, to measure how the pipeline scales with it.
+
+Run as a script to generate one:
+python -m spectrum.synthesizer FIGURES VIDEOS SUPPLEMENTARY_FILES BODY_SIZE [PDF_SIZE]"""
+import os
+from os import path
+import sys
+
+from spectrum import generator, logger
+
+LOGGER = logger.logger(__name__)
+BASE_TEMPLATE_ID = '99999'
+# real image and video, so that they can be converted by the pipeline
+FIGURE_FILENAME = 'spectrum/templates/elife-00777-vor-r1/elife-00777-fig1.tif'
+VIDEO_FILENAME = 'spectrum/templates/elife-00777-vor-r1/elife-00777-video1.mp4'
+# opaque content, for supplementary files and to pad PDFs
+HEAVY_FILENAME = 'sample.heavy'
+SYNTHETIC_DIRECTORY = 'build/synthetic'
+PARAGRAPH = ("Synthetic text that makes the body of this article as long as requested. " * 14).strip()
+
+def article_zip(figures=0, videos=0, supplementary_files=0, body_size=0, pdf_size=None, id=None):
+    """body_size and pdf_size are in bytes; without a pdf_size, the article has no PDF.
+
+    Binary files are copies of the same few sources, so they are stored only once by the payload store"""
+    template_variables = {
+        'synthetic': {
+            'paragraphs': [PARAGRAPH] * (body_size // len(PARAGRAPH)),
+            'figures': range(1, figures + 1),
+            'videos': range(1, videos + 1),
+            'supplementary_files': range(1, supplementary_files + 1),
+            'pdf': pdf_size is not None,
+        }
+    }
+    additional_files = {}
+    for figure in range(1, figures + 1):
+        additional_files['elife-%s-fig%d.tif' % (BASE_TEMPLATE_ID, figure)] = FIGURE_FILENAME
+    for video in range(1, videos + 1):
+        additional_files['elife-%s-video%d.mp4' % (BASE_TEMPLATE_ID, video)] = VIDEO_FILENAME
+    for supplementary_file in range(1, supplementary_files + 1):
+        additional_files['elife-%s-supp%d.dat' % (BASE_TEMPLATE_ID, supplementary_file)] = HEAVY_FILENAME
+    if pdf_size is not None:
+        additional_files['elife-%s.pdf' % BASE_TEMPLATE_ID] = _pdf(pdf_size)
+    article = generator.article_zip(BASE_TEMPLATE_ID, template_variables=template_variables, id=id, additional_files=additional_files)
+    LOGGER.info(
+        "Synthesized %s with %d figures, %d videos, %d supplementary files, %d bytes of body and %s bytes of PDF",
+        article.filename(),
+        figures,
+        videos,
+        supplementary_files,
+        body_size,
+        pdf_size,
+        extra={'id': article.id()}
+    )
+    return article
+
+def _pdf(size):
+    "Returns the name of a valid PDF file of exactly size bytes (or the minimum possible), creating it once"
+    filename = '%s/padded-%d.pdf' % (SYNTHETIC_DIRECTORY, size)
+    if path.exists(filename):
+        return filename
+    # lengths and offsets are written with a fixed width, so the size grows exactly with the padding
+    padding_length = max(size - len(_pdf_content('')), 0)
+    content = _pdf_content(_heavy_content(padding_length))
+    if not path.exists(SYNTHETIC_DIRECTORY):
+        try:
+            os.makedirs(SYNTHETIC_DIRECTORY)
+        except OSError:
+            # another process created it in the meantime
+            pass
+    temporary_filename = "%s.%s.tmp" % (filename, os.getpid())
+    with open(temporary_filename, 'wb') as pdf_file:
+        pdf_file.write(content)
+    os.rename(temporary_filename, filename)
+    return filename
+
+def _pdf_content(padding):
+    "A single blank page, followed by an unused stream object containing padding"
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>',
+        '<< /Length %010d >>\nstream\n%s\nendstream' % (len(padding), padding),
+    ]
+    parts = ['%PDF-1.4\n']
+    offsets = []
+    position = len(parts[0])
+    for number, body in enumerate(objects, 1):
+        offsets.append(position)
+        parts.append('%d 0 obj\n%s\nendobj\n' % (number, body))
+        position = position + len(parts[-1])
+    parts.append('xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    parts.extend('%010d 00000 n \n' % offset for offset in offsets)
+    parts.append('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%010d\n%%%%EOF\n' % (len(objects) + 1, position))
+    return ''.join(parts)
+
+def _heavy_content(length):
+    with open(HEAVY_FILENAME, 'rb') as heavy_file:
+        heavy = heavy_file.read()
+    return (heavy * (length // len(heavy) + 1))[:length]
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print "Usage: %s FIGURES VIDEOS SUPPLEMENTARY_FILES BODY_SIZE [PDF_SIZE]\n" % sys.argv[0]
+        exit(1)
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    print article_zip(*arguments).filename()
@@ -1,12 +1,15 @@
 "Test that involve publishing articles and checking their visibility and correctness throughout different systems"
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 import os
 import re
 import pytest
-import requests
 from spectrum import generator
 from spectrum import input
 from spectrum import checks
+from spectrum import sessions
+from spectrum import pipeline
 
 @pytest.mark.continuum
 @pytest.mark.article
@@ -147,7 +150,7 @@ def _test_adding_article_fragment(generate_article):
     article = checks.API.article(article.id())
     # TODO: transition to IIIF and use a IiifCheck object
     image_url = article['image']['banner']['sizes']['2:1']['1800']
-    response = requests.head(image_url)
+    response = sessions.head(image_url)
     checks.LOGGER.info("Found %s: %s", image_url, response.status_code)
     assert response.status_code == 200, "Image %s is not loading" % image_url
 
@@ -159,48 +162,86 @@ def _feed_silent_correction(article):
     input.SILENT_CORRECTION_BUCKET.upload(article.filename(), article.id())
 
 def _wait_for_publishable(article, run_after):
+    id = article.id()
+    version = article.version()
+    graph = pipeline.CheckGraph(id=id)
+    eif_dependencies = []
+    cdn_checks = []
     if run_after:
-        checks.DASHBOARD.ready_to_publish(id=article.id(), version=article.version(), run_after=run_after)
+        graph.add('dashboard_ingested', partial(checks.DASHBOARD.ready_to_publish, id=id, version=version, run_after=run_after))
+        eif_dependencies.append('dashboard_ingested')
     # fails quite often but is now late in the process, can we make an intermediate check?
-    (run, ) = checks.EIF.of(id=article.id(), version=article.version())
+    graph.add('eif', lambda **_: checks.EIF.of(id=id, version=version), depends_on=eif_dependencies)
     for each in article.figure_names():
-        checks.IMAGES_BOT_CDN.of(id=article.id(), figure_name=each, version=article.version())
-        checks.IMAGES_PUBLISHED_CDN.of(id=article.id(), figure_name=each, version=article.version())
-    checks.XML_PUBLISHED_CDN.of(id=article.id(), version=article.version())
-    checks.XML_DOWNLOAD_PUBLISHED_CDN.of(id=article.id(), version=article.version())
+        cdn_checks.append(('images_bot_cdn_%s' % each, partial(checks.IMAGES_BOT_CDN.of, id=id, figure_name=each, version=version)))
+        cdn_checks.append(('images_published_cdn_%s' % each, partial(checks.IMAGES_PUBLISHED_CDN.of, id=id, figure_name=each, version=version)))
+    cdn_checks.append(('xml_published_cdn', partial(checks.XML_PUBLISHED_CDN.of, id=id, version=version)))
+    cdn_checks.append(('xml_download_published_cdn', partial(checks.XML_DOWNLOAD_PUBLISHED_CDN.of, id=id, version=version)))
     if article.has_pdf():
-        checks.PDF_BOT_CDN.of(id=article.id(), version=article.version())
-        checks.PDF_PUBLISHED_CDN.of(id=article.id(), version=article.version())
-        checks.PDF_DOWNLOAD_PUBLISHED_CDN.of(id=article.id(), version=article.version())
-    checks.API_PREVIEW.article(id=article.id(), version=article.version())
-    checks.WEBSITE.unpublished(id=article.id(), version=article.version())
-    checks.DASHBOARD.ready_to_publish(id=article.id(), version=article.version(), run=run)
+        cdn_checks.append(('pdf_bot_cdn', partial(checks.PDF_BOT_CDN.of, id=id, version=version)))
+        cdn_checks.append(('pdf_published_cdn', partial(checks.PDF_PUBLISHED_CDN.of, id=id, version=version)))
+        cdn_checks.append(('pdf_download_published_cdn', partial(checks.PDF_DOWNLOAD_PUBLISHED_CDN.of, id=id, version=version)))
+    for (name, check_fn) in cdn_checks:
+        graph.add(name, check_fn)
+    # the preview API does not poll, it has to find the article already converted and on the CDN
+    graph.add(
+        'api_preview',
+        lambda **_: checks.API_PREVIEW.article(id=id, version=version),
+        depends_on=['eif'] + [name for (name, _) in cdn_checks]
+    )
+    graph.add('website_unpublished', partial(checks.WEBSITE.unpublished, id=id, version=version))
+    graph.add('dashboard_ready_to_publish', lambda eif: checks.DASHBOARD.ready_to_publish(id=id, version=version, run=eif[0]), depends_on=['eif'])
+    results = graph.run()
+    (run, ) = results['eif']
     return run
 
 def _wait_for_published(article):
-    checks.DASHBOARD.published(id=article.id(), version=article.version())
-    version_info = checks.LAX.published(id=article.id(), version=article.version())
-    checks.WEBSITE.published(id=article.id(), version=article.version())
-    checks.WEBSITE.visible('/content/%s/e%sv%s' % \
-        (version_info['volume'], version_info['manuscript_id'], \
-         version_info['version']), id=article.id())
-
-    checks.ARCHIVE.of(id=article.id(), version=article.version())
-    article_from_api = checks.API.article(id=article.id(), version=article.version())
-    checks.JOURNAL.article(id=article.id(), volume=article_from_api['volume'], has_figures=article.has_figures())
-    checks.JOURNAL_CDN.article(id=article.id(), volume=article_from_api['volume'], has_figures=article.has_figures())
-    checks.GITHUB_XML.article(id=article.id(), version=article.version())
-    return article_from_api
+    id = article.id()
+    version = article.version()
+    graph = pipeline.CheckGraph(id=id)
+    graph.add('dashboard_published', partial(checks.DASHBOARD.published, id=id, version=version))
+    graph.add('lax_published', partial(checks.LAX.published, id=id, version=version))
+    graph.add('website_published', partial(checks.WEBSITE.published, id=id, version=version))
+    graph.add(
+        'website_visible',
+        lambda lax_published: checks.WEBSITE.visible(
+            '/content/%s/e%sv%s' % (lax_published['volume'], lax_published['manuscript_id'], lax_published['version']),
+            id=id
+        ),
+        depends_on=['lax_published']
+    )
+    graph.add('archive', partial(checks.ARCHIVE.of, id=id, version=version))
+    # the API does not poll, it has to find the article already published
+    graph.add(
+        'api',
+        lambda **_: checks.API.article(id=id, version=version),
+        depends_on=['dashboard_published', 'lax_published', 'website_published', 'website_visible', 'archive']
+    )
+    graph.add('journal', lambda api: checks.JOURNAL.article(id=id, volume=api['volume'], has_figures=article.has_figures()), depends_on=['api'])
+    graph.add('journal_cdn', lambda api: checks.JOURNAL_CDN.article(id=id, volume=api['volume'], has_figures=article.has_figures()), depends_on=['api'])
+    graph.add('github_xml', partial(checks.GITHUB_XML.article, id=id, version=version))
+    return graph.run()['api']
 
 def _publish(article, run_after):
     run = _wait_for_publishable(article, run_after)
     input.DASHBOARD.publish(id=article.id(), version=article.version(), run=run)
 
 def _ingest_and_publish_and_wait_for_published(article):
-    _ingest_and_publish(article)
-    return _wait_for_published(article)
+    ingestion_start = datetime.now()
+    with _monitoring(article, run_after=ingestion_start):
+        _ingest(article)
+        _publish(article, run_after=ingestion_start)
+        return _wait_for_published(article)
 
 def _ingest_and_publish(article):
     ingestion_start = datetime.now()
-    _ingest(article)
-    _publish(article, run_after=ingestion_start)
+    with _monitoring(article, run_after=ingestion_start):
+        _ingest(article)
+        _publish(article, run_after=ingestion_start)
+
+@contextmanager
+def _monitoring(article, run_after):
+    "Fails all checks on the article when it runs out of time or as soon as the dashboard reports an error"
+    with checks.deadline(article.id()):
+        with checks.DASHBOARD.watching_errors(article.id(), article.version(), run_after=run_after):
+            yield
@@ -1,12 +1,13 @@
 "Tests that go through Journal CMS and propagate content to the rest of the system"
 import pytest
-import requests
 from spectrum import input
 from spectrum import checks
+from spectrum import sessions
 
 @pytest.mark.journal_cms
 def test_login():
-    input.JOURNAL_CMS.login()
+    # a session saved by a previous run would hide a broken login
+    input.JOURNAL_CMS.login(reuse=False)
 
 @pytest.mark.journal_cms
 @pytest.mark.search
@@ -24,7 +25,7 @@ def test_content_type_propagates_to_other_services():
     blog_article = checks.API.blog_article(id)
     # TODO: transition to IIIF and use a IiifCheck object
     image_url = blog_article['image']['banner']['sizes']['2:1']['1800']
-    response = requests.head(image_url)
+    response = sessions.head(image_url)
     checks.LOGGER.info("Found %s: %s", image_url, response.status_code)
     assert response.status_code == 200, "Image %s is not loading" % image_url
 
@@ -1,10 +1,12 @@
 #!/bin/bash
 set -e
 
-for id in 00777 00666
-do
-    ./download-from-s3.sh $id
-    ./import.sh elife-$id-vor-r1.zip
-done
+# only the zips that changed since the last sync are downloaded and imported
+filenames=$(venv/bin/python -m spectrum.sync 00777 00666)
+if [ -n "$filenames" ]; then
+    # stdout is the summary of the update: the S3 keys of the new revisions
+    ./import.sh $filenames 1>&2
+    venv/bin/python -m spectrum.sync --record
+fi
 
 git add spectrum/templates